@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -47,15 +48,62 @@ INSTALLED_APPS = [
     'users',
 ]
 
-# REST_FRAMEWORK = {
-#     'DEFAULT_AUTHENTICATION_CLASSES': (
-#         'rest_framework.authentication.TokenAuthentication',
-#     ),
-# }
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'users.authentication.CachedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+}
+
+# Кэш Django. Кэш в памяти по умолчанию виден только своему процессу; для
+# нескольких воркеров нужен общий бэкенд, на одном хосте подойдет
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# с каталогом в CACHE_LOCATION
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+# Кэш проверенных токенов: LRU в памяти процесса и, если задан
+# TOKEN_CACHE_ALIAS, общий кэш Django, через который другие процессы сразу
+# узнают об отзыве. Без общего кэша отзыв виден только своему процессу, а
+# остальные принимают отозванный токен до истечения TOKEN_CACHE_TTL, поэтому
+# по умолчанию он тогда всего 5 секунд: запрос к базе за токеном делается
+# не чаще раза в 5 секунд на токен в каждом процессе. При нескольких
+# воркерах лучше задать общий кэш
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_ALIAS = os.environ.get('TOKEN_CACHE_ALIAS') or None
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60 if TOKEN_CACHE_ALIAS else 5))
+
+if TOKEN_CACHE_ALIAS:
+    token_backend = CACHES.get(TOKEN_CACHE_ALIAS, {}).get('BACKEND', '')
+    if token_backend.endswith(('.LocMemCache', '.DummyCache')):
+        raise ImproperlyConfigured(
+            "Отзыв токена в локальном кэше не виден другим воркерам: "
+            "TOKEN_CACHE_ALIAS должен указывать на общий кэш"
+        )
+
+# Кэш ответов статистики за период. Нужен общий для всех процессов кэш:
+# версии дат, меняющиеся при загрузке интервалов, должны видеть все процессы
+
+STATISTICS_CACHE_ALIAS = os.environ.get('STATISTICS_CACHE_ALIAS') or None
+STATISTICS_CACHE_TTL = int(os.environ.get('STATISTICS_CACHE_TTL', 3600))
+STATISTICS_CACHE_MAX_DAYS = int(os.environ.get('STATISTICS_CACHE_MAX_DAYS', 366))
+
+# Предел размера тела запроса после распаковки gzip/zstd. Сжатое тело
+# ограничивает прокси, несжатое JSON-тело этим пределом не ограничено
+
+MAX_DECOMPRESSED_BODY_SIZE = int(os.environ.get('MAX_DECOMPRESSED_BODY_SIZE', 20 * 1024 * 1024))
 
 AUTH_USER_MODEL = "users.CustomUser"
 
 MIDDLEWARE = [
+    'times.perf.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +111,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'times.replicas.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -100,17 +149,85 @@ WSGI_APPLICATION = 'core.wsgi.application'
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 # }
+# Асинхронные create_intervals и статистика за период; включать при запуске
+# под ASGI-сервером (docker-compose.asgi.yml), под WSGI они только медленнее
+
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Соединение с базой живет DB_CONN_MAX_AGE секунд и переиспользуется между
+# запросами воркера; перед повторным использованием Django проверяет его.
+# Под ASGI каждый запрос идет в своем потоке, постоянные соединения там
+# копятся, поэтому по умолчанию они выключены - вместо них внешний пул
+
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 60))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.environ.get('POSTGRES_DB'),
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
-        'HOST': 'db',
-        'PORT': 5432,
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+        'PORT': int(os.environ.get('POSTGRES_PORT', 5432)),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        # По имени приложения синхронизация отличает свои соединения от чужих
+        'OPTIONS': {'application_name': os.environ.get('DB_APPLICATION_NAME', 'backend')},
     }
 }
 
+# Встроенного пула соединений в Django 4.2 с psycopg2 нет. Если соединений
+# воркеров больше, чем max_connections PostgreSQL (особенно под ASGI), их
+# пулит внешний PgBouncer в режиме pool_mode=transaction: POSTGRES_HOST и
+# POSTGRES_PORT указывают на него. Серверные курсоры в этом режиме не
+# работают, их выключает DB_DISABLE_SERVER_SIDE_CURSORS=True
+
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = (
+    os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 'False') == 'True'
+)
+
+# Чтения статистики и интервалов идут на реплику, если задан DB_REPLICA_HOST.
+# После записи чтения пользователя REPLICA_PIN_SECONDS идут в основную базу;
+# при нескольких воркерах отметки должны лежать в общем кэше. Без реплики
+# alias указывает на основную базу и чтения с него выключены. В тестах он
+# зеркало основной тестовой базы, так что маршрутизация проверяется и без
+# второго сервера
+
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+REPLICA_PIN_CACHE_ALIAS = os.environ.get('REPLICA_PIN_CACHE_ALIAS', 'default')
+REPLICA_READS = bool(os.environ.get('DB_REPLICA_HOST'))
+
+if REPLICA_READS:
+    pin_backend = CACHES.get(REPLICA_PIN_CACHE_ALIAS, {}).get('BACKEND', '')
+    if pin_backend.endswith(('.LocMemCache', '.DummyCache')):
+        raise ImproperlyConfigured(
+            "Отметки реплики в локальном кэше не видны другим воркерам: "
+            "задайте общий кэш в CACHE_BACKEND или REPLICA_PIN_CACHE_ALIAS"
+        )
+
+DATABASES[REPLICA_DATABASE] = {
+    **DATABASES['default'],
+    'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+    'PORT': int(os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT'])),
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['times.replicas.ReplicaRouter']
+
+# Замеры запросов (Server-Timing, /api/metrics/) для доли PERF_SAMPLE_RATE
+# запросов; 0 выключает замеры. С PERF_PROFILE_DIR замеряемые запросы
+# дольше PERF_PROFILE_THRESHOLD_MS сохраняют профиль cProfile в каталог
+
+PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE', 0))
+PERF_PROFILE_DIR = os.environ.get('PERF_PROFILE_DIR') or None
+PERF_PROFILE_THRESHOLD_MS = int(os.environ.get('PERF_PROFILE_THRESHOLD_MS', 500))
+
+# Статистика пишется приращениями в отдельную таблицу без блокировок
+# строк Statistics; приращения сворачивает команда compact_statistics
+
+STATISTICS_DELTAS = os.environ.get('STATISTICS_DELTAS', 'False') == 'True'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,11 +1,14 @@
 #!/bin/sh
+set -e
 
 until nc -z db 5432; do
   echo "Waiting for PostgreSQL..."
   sleep 1
 done
 
+python manage.py create_indexes_concurrently
 python manage.py migrate --noinput
+python manage.py rebuild_rollups --stale
 python manage.py createsuperuser --noinput --email admin@admin.admin || true
 
 exec "$@"
@@ -1,4 +1,5 @@
 #!/bin/sh
+set -e
 
 echo "Ожидание PostgreSQL..."
 while ! nc -z db 5432; do
@@ -7,6 +8,8 @@ done
 echo "PostgreSQL доступен!"
 
 python manage.py makemigrations --noinput
+python manage.py create_indexes_concurrently
 python manage.py migrate --noinput
+python manage.py rebuild_rollups --stale
 
 exec "$@"
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TimeInterval, Statistics
+from .models import TimeInterval, Statistics, StatisticsRollup
 
 @admin.register(TimeInterval)
 class TimeIntervalAdmin(admin.ModelAdmin):
@@ -9,3 +9,4 @@ class TimeIntervalAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
 
 admin.site.register(Statistics)
+admin.site.register(StatisticsRollup)
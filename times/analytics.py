@@ -0,0 +1,145 @@
+from datetime import timedelta
+import numpy as np
+from .models import TimeInterval
+
+# Начало и конец интервала хранятся в секундах от начала суток
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+FOCUS_MAX_GAP = 5 * 60
+FOCUS_MIN_DURATION = 25 * 60
+
+
+class IntervalArrays:
+    """
+    Интервалы пользователя за период в виде столбцов NumPy, отсортированные
+    по началу. Время - секунды от начала периода, сайт - индекс в hostnames.
+    """
+
+    def __init__(self, start_date, days, starts, ends, sites, hostnames):
+        self.start_date = start_date
+        self.days = days
+        self.starts = starts
+        self.ends = ends
+        self.sites = sites
+        self.hostnames = hostnames
+
+    @classmethod
+    def load(cls, user_pk, start_date, end_date):
+        rows = TimeInterval.objects.filter(
+            user__pk=user_pk,
+            date__gte=start_date,
+            date__lte=end_date,
+        ).order_by().values_list('date', 'start_time', 'end_time', 'hostname')
+        dates, starts, ends, hostnames = zip(*rows) if rows else ((), (), (), ())
+
+        day_offsets = (
+            np.array(dates, dtype='datetime64[D]') - np.datetime64(start_date, 'D')
+        ).astype(np.int64) * SECONDS_PER_DAY
+        starts = day_offsets + np.array(starts, dtype=np.int64)
+        ends = day_offsets + np.array(ends, dtype=np.int64)
+        unique_hostnames, sites = np.unique(np.array([hostname or '' for hostname in hostnames], dtype=object), return_inverse=True)
+
+        order = np.lexsort((ends, starts))
+        return cls(
+            start_date,
+            (end_date - start_date).days + 1,
+            starts[order],
+            ends[order],
+            sites.reshape(-1)[order],
+            unique_hostnames.tolist(),
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def group_starts(self, breaks):
+        """Индексы первых интервалов групп по маске разрывов между соседями"""
+        return np.flatnonzero(np.concatenate(([True], breaks)))
+
+    def merged(self):
+        """
+        Объединяет пересекающиеся и соприкасающиеся интервалы в
+        непересекающиеся отрезки, не переходящие через полночь.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        reach = np.maximum.accumulate(self.ends)
+        days = self.starts // SECONDS_PER_DAY
+        breaks = (self.starts[1:] > reach[:-1]) | (days[1:] != days[:-1])
+        first = self.group_starts(breaks)
+        return self.starts[first], np.maximum.reduceat(self.ends, first)
+
+    def hourly(self):
+        """Активное время по часам периода, без двойного учета пересечений"""
+        starts, ends = self.merged()
+        boundaries = np.arange(self.days * 24 + 1, dtype=np.int64) * SECONDS_PER_HOUR
+        covered = np.concatenate(([0], np.cumsum(ends - starts)))
+
+        # Покрытое время до каждой границы: отрезки, закончившиеся до нее,
+        # плюс начатая часть отрезка, внутри которого она лежит
+        index = np.searchsorted(ends, boundaries, side='right')
+        partial = np.zeros_like(boundaries)
+        inside = index < len(starts)
+        partial[inside] = np.clip(boundaries[inside] - starts[index[inside]], 0, None)
+        return np.diff(covered[index] + partial).reshape(self.days, 24)
+
+    def sessions(self, max_gap=FOCUS_MAX_GAP, min_duration=FOCUS_MIN_DURATION):
+        """
+        Сессии фокуса: подряд идущие интервалы одного сайта с паузами
+        не длиннее max_gap, общей длительностью не меньше min_duration.
+        """
+        if not len(self):
+            return []
+
+        # Пауза считается от самого позднего конца внутри серии интервалов
+        # одного сайта: конец интервала другого сайта ее не сокращает
+        site_changes = self.sites[1:] != self.sites[:-1]
+        runs = np.concatenate(([0], np.cumsum(site_changes)))
+        offset = runs * (int(self.ends.max()) + 1)
+        reach = np.maximum.accumulate(self.ends + offset) - offset
+        breaks = site_changes | (self.starts[1:] - reach[:-1] > max_gap)
+        first = self.group_starts(breaks)
+        starts = self.starts[first]
+        ends = np.maximum.reduceat(self.ends, first)
+        active = np.minimum(np.add.reduceat(self.ends - self.starts, first), ends - starts)
+
+        focused = np.flatnonzero(ends - starts >= min_duration)
+        return [
+            {
+                'url': self.hostnames[self.sites[first[i]]],
+                **self.position(starts[i], ends[i]),
+                'activeTime': int(active[i]),
+            }
+            for i in focused
+        ]
+
+    def date(self, day):
+        return (self.start_date + timedelta(days=day)).isoformat()
+
+    def position(self, start, end):
+        day = int(start) // SECONDS_PER_DAY
+        return {
+            'date': self.date(day),
+            'startTime': int(start) - day * SECONDS_PER_DAY,
+            'endTime': int(end) - day * SECONDS_PER_DAY,
+        }
+
+
+def build_timeline(user_pk, start_date, end_date, max_gap=FOCUS_MAX_GAP, min_duration=FOCUS_MIN_DURATION):
+    arrays = IntervalArrays.load(user_pk, start_date, end_date)
+    starts, ends = arrays.merged()
+    hourly = arrays.hourly()
+
+    return {
+        'activeTime': int((ends - starts).sum()),
+        'timeline': [arrays.position(start, end) for start, end in zip(starts, ends)],
+        'hours': hourly.sum(axis=0).tolist(),
+        'days': [
+            {'date': arrays.date(day), 'hours': hours}
+            for day, hours in enumerate(hourly.tolist())
+            if any(hours)
+        ],
+        'sessions': arrays.sessions(max_gap, min_duration),
+    }
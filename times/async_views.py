@@ -0,0 +1,164 @@
+"""
+Асинхронные варианты create_intervals и StatisticsRangeView для запуска
+под ASGI-сервером (ASYNC_VIEWS=True). Ответы совпадают с синхронными
+представлениями; проверка токена и чтение статистики идут через
+асинхронный ORM, запись пакета - одной синхронной транзакцией в потоке.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
+from users.authentication import CachedTokenAuthentication
+from . import response_cache
+from .replicas import database_for, reading
+from .ingest import ingest_intervals, enqueue_intervals
+from .parsers import JSONParser, CompactIntervalsParser, DecompressedBodyTooLarge
+from .views import StatisticsRangeView
+
+authentication = CachedTokenAuthentication()
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+async def authenticate(request):
+    """Пользователь запроса и None или None и ответ с ошибкой, как у DRF"""
+    try:
+        result = await authentication.aauthenticate(request)
+    except exceptions.AuthenticationFailed as e:
+        return None, unauthorized(e)
+
+    if result is None:
+        return None, unauthorized(exceptions.NotAuthenticated())
+    return result[0], None
+
+
+def unauthorized(error):
+    response = JsonResponse({'detail': str(error.detail)}, status=error.status_code)
+    response['WWW-Authenticate'] = authentication.authenticate_header(None)
+    return response
+
+
+def json_response(data, **kwargs):
+    """JsonResponse с данными в data, как у ответа DRF, для замеров perf"""
+    response = JsonResponse(data, safe=False, json_dumps_params=JSON_PARAMS, **kwargs)
+    response.data = data
+    return response
+
+
+def to_json_response(response):
+    """Переводит ответ DRF в JsonResponse, сохраняя статус и заголовки"""
+    result = json_response(response.data, status=response.status_code)
+    for name, value in response.items():
+        if name.lower() != 'content-type':
+            result[name] = value
+    return result
+
+
+def parse_intervals(request):
+    if request.content_type == CompactIntervalsParser.media_type:
+        parser = CompactIntervalsParser()
+    else:
+        parser = JSONParser()
+    # Тело читается из потока, как в DRF: request.body ограничен
+    # DATA_UPLOAD_MAX_MEMORY_SIZE, а синхронное представление - нет
+    return parser.parse(request, request.content_type, {'request': request})
+
+
+@transaction.atomic
+def save_batch(items, user, mode):
+    if mode == 'async':
+        batch = enqueue_intervals(items, user)
+        return JsonResponse({
+                'status': 'accepted',
+                'batch': batch.pk,
+                'queued': len(batch.payload),
+            }, status=202)
+
+    processed, duplicates = ingest_intervals(items, user)
+    return JsonResponse({
+            'status': 'success',
+            'processed': processed,
+            'duplicates': duplicates,
+        })
+
+
+async def create_intervals_async(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    user, error = await authenticate(request)
+    if error:
+        return error
+
+    # Для ReplicaPinMiddleware, как это делает запрос DRF
+    request.user = user
+    try:
+        data = parse_intervals(request)
+        return await sync_to_async(save_batch)(data.get('intervals', []), user, request.GET.get('mode'))
+
+    except DecompressedBodyTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+    except (json.JSONDecodeError, ParseError):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except KeyError as e:
+        return JsonResponse({'error': f'Missing field: {str(e)}'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# csrf_exempt в Django 4.2 оборачивает представление синхронной функцией
+create_intervals_async.csrf_exempt = True
+
+
+class StatisticsRangeAsyncView(View):
+    async def get(self, request):
+        user, error = await authenticate(request)
+        if error:
+            return error
+
+        request = Request(request)
+        request.user = user
+        with reading(await sync_to_async(database_for)(user)):
+            return await self.get_response(request, user)
+
+    async def get_response(self, request, user):
+        view = StatisticsRangeView()
+        start_date, end_date, fields, granularity, error = view.get_params(request)
+        if error:
+            return to_json_response(error)
+
+        if not response_cache.is_cacheable(start_date, end_date):
+            response = await self.build_response(view, request, start_date, end_date, fields, granularity)
+            return to_json_response(response)
+
+        options = view.get_cache_options(fields, granularity)
+        data, etag = await sync_to_async(response_cache.lookup)(user.pk, start_date, end_date, options)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        if data is None:
+            response = await self.build_response(view, request, start_date, end_date, fields, granularity)
+            await sync_to_async(response_cache.store)(user.pk, start_date, end_date, options, etag, response.data)
+            response = to_json_response(response)
+        else:
+            response = json_response(data)
+        response['ETag'] = etag
+        return response
+
+    async def build_response(self, view, request, start_date, end_date, fields, granularity):
+        if granularity == 'auto' or settings.STATISTICS_DELTAS:
+            # Статистика и приращения читаются одним снимком в одном вызове
+            return await sync_to_async(view.build_response)(request, start_date, end_date, fields, granularity)
+
+        statistics = [stat async for stat in view.get_statistics(request, start_date, end_date, fields)]
+        return await sync_to_async(view.statistics_response)(request, statistics, start_date, end_date, fields)
@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, connections, router, transaction
+from django.db.models import Max, Sum
+from . import response_cache
+from .ingest import merge_statistics, merge_rollups
+from .models import Statistics, StatisticsDelta, StatisticsRollup
+from .rollups import collect_rollups, period_start, split_range
+
+
+def compact_deltas(limit):
+    """
+    Сворачивает до limit приращений в Statistics и сводную статистику.
+    Приращения удаляются и применяются в одной транзакции; строки,
+    заблокированные другим обработчиком, пропускаются.
+    Возвращает количество свернутых приращений.
+    """
+    table = connection.ops.quote_name(StatisticsDelta._meta.db_table)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING user_id, url, period_date, session_count, time_count, favicon_url
+                """,
+                [limit],
+            )
+            deltas = cursor.fetchall()
+
+        updates_by_user = {}
+        for user_id, url, period_date, session_count, time_count, favicon_url in deltas:
+            stats_updates = updates_by_user.setdefault(user_id, {})
+            add_delta(stats_updates, (url, period_date), session_count, time_count, favicon_url)
+
+        for user_id, stats_updates in updates_by_user.items():
+            merge_statistics(stats_updates, user_id)
+            merge_rollups(collect_rollups(stats_updates), user_id)
+
+            dates = {period_date for url, period_date in stats_updates}
+            transaction.on_commit(lambda user_id=user_id, dates=dates: response_cache.bump_versions(user_id, dates))
+
+    return len(deltas)
+
+
+def add_delta(updates, key, session_count, time_count, favicon_url):
+    if key not in updates:
+        updates[key] = {
+            'session_count': 0,
+            'time_count': 0,
+            'favicon_url': None,
+        }
+
+    updates[key]['session_count'] += session_count
+    updates[key]['time_count'] += time_count
+    updates[key]['favicon_url'] = updates[key]['favicon_url'] or favicon_url
+
+
+@contextmanager
+def statistics_snapshot():
+    """
+    С приращениями Statistics, сводная статистика и несвернутые
+    приращения читаются внутри блока одним снимком базы (REPEATABLE READ):
+    свертка, зафиксированная между запросами, иначе потеряла бы или
+    удвоила часть приращений. Внутри уже открытой транзакции уровень
+    изоляции не меняется.
+    """
+    using = router.db_for_read(Statistics)
+    if not settings.STATISTICS_DELTAS or connections[using].in_atomic_block:
+        yield
+        return
+
+    with transaction.atomic(using=using):
+        if connections[using].vendor == 'postgresql':
+            with connections[using].cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield
+
+
+def pending_deltas(user_pk, start_date, end_date):
+    """Несвернутые приращения пользователя за период по ключу (сайт, дата)"""
+    rows = StatisticsDelta.objects.filter(
+        user__pk=user_pk,
+        period_date__gte=start_date,
+        period_date__lte=end_date,
+    ).values('url', 'period_date').annotate(
+        favicon=Max('favicon_url'),
+        sessions=Sum('session_count'),
+        time=Sum('time_count'),
+    ).order_by()
+
+    pending = {}
+    for row in rows:
+        add_delta(pending, (row['url'], row['period_date']), row['sessions'], row['time'], row['favicon'])
+    return pending
+
+
+def apply_to_statistics(statistics, pending, user_pk):
+    """
+    Добавляет приращения к записям Statistics. Для ключей, которых
+    еще нет в базе, создаются несохраненные записи.
+    """
+    by_key = {(stat.url, stat.period_date): stat for stat in statistics}
+    for (url, period_date), data in pending.items():
+        stat = by_key.get((url, period_date))
+        if stat is None:
+            stat = Statistics(url=url, period_date=period_date, user_id=user_pk)
+            statistics.append(stat)
+
+        stat.session_count += data['session_count']
+        stat.time_count += data['time_count']
+        stat.favicon_url = stat.favicon_url or data['favicon_url']
+
+    statistics.sort(key=lambda stat: -stat.time_count)
+    return statistics
+
+
+def apply_to_rows(rows, pending, start_date, end_date):
+    """
+    Добавляет приращения к строкам уровней (день, неделя, месяц),
+    покрывающих период так же, как в split_range.
+    """
+    months, weeks, day_ranges = split_range(start_date, end_date)
+    months, weeks = set(months), set(weeks)
+
+    updates = {}
+    for (url, period_date), data in pending.items():
+        if any(start <= period_date <= end for start, end in day_ranges):
+            key = (url, 'day', period_date)
+        elif period_start(StatisticsRollup.WEEK, period_date) in weeks:
+            key = (url, StatisticsRollup.WEEK, period_start(StatisticsRollup.WEEK, period_date))
+        elif period_start(StatisticsRollup.MONTH, period_date) in months:
+            key = (url, StatisticsRollup.MONTH, period_start(StatisticsRollup.MONTH, period_date))
+        else:
+            continue
+        add_delta(updates, key, data['session_count'], data['time_count'], data['favicon_url'])
+
+    by_key = {(row['url'], row['period'], row['period_date']): row for row in rows}
+    for (url, period, period_date), data in updates.items():
+        row = by_key.get((url, period, period_date))
+        if row is None:
+            row = {
+                'url': url,
+                'favicon_url': None,
+                'session_count': 0,
+                'time_count': 0,
+                'period': period,
+                'period_date': period_date,
+            }
+            rows.append(row)
+
+        row['session_count'] += data['session_count']
+        row['time_count'] += data['time_count']
+        row['favicon_url'] = row['favicon_url'] or data['favicon_url']
+
+    return rows
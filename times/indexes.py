@@ -0,0 +1,20 @@
+from django.db import models
+
+
+class ConcurrentIndex(models.Index):
+    """
+    Индекс, создаваемый через CREATE INDEX IF NOT EXISTS.
+    На большой таблице его можно заранее построить без блокировки записи
+    командой create_indexes_concurrently, после чего migrate пропустит
+    уже существующий индекс.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        statement = super().create_sql(model, schema_editor, using=using, **kwargs)
+        if statement.template.startswith('CREATE INDEX CONCURRENTLY '):
+            statement.template = statement.template.replace(
+                'CREATE INDEX CONCURRENTLY ', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ', 1
+            )
+        else:
+            statement.template = statement.template.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+        return statement
@@ -0,0 +1,284 @@
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from urllib.parse import urlparse
+from utils.hostname import get_hostname
+from .models import TimeInterval, Statistics, StatisticsRollup, StatisticsDelta, IntervalBatch
+from .rollups import collect_rollups
+from . import response_cache
+
+
+def build_interval(item, user):
+    favicon_url = item.get('faviconUrl')
+
+    interval = TimeInterval(
+        start_time=item['startTime'],
+        end_time=item['endTime'],
+        date=item['date'],
+        url=item['url'] if len(item['url']) <= 500 else '{url.scheme}://{url.netloc}'.format(url=urlparse(item["url"])),
+        favicon_url=favicon_url if favicon_url is not None and len(favicon_url) <= 500 else None,
+        user=user,
+    )
+
+    # Уникальность и существование пользователя проверяются одним запросом
+    # на весь пакет, а не отдельным запросом на каждый интервал
+    interval.full_clean(exclude=['user'], validate_unique=False, validate_constraints=False)
+    interval.hostname = get_hostname(interval.url)
+    interval.fingerprint = interval.get_fingerprint()
+    return interval
+
+
+def insert_intervals(intervals):
+    """
+    Вставляет интервалы одним запросом и возвращает вставленные. Уже
+    сохраненные отпечатки пропускаются самой вставкой, поэтому повтор
+    пакета, который еще сохраняется параллельно, не считается новым.
+    """
+    if not intervals:
+        return []
+
+    table = connection.ops.quote_name(TimeInterval._meta.db_table)
+    updated_at = timezone.now()
+    rows = []
+    params = []
+    for interval in intervals:
+        interval.updated_at = updated_at
+        rows.append('(%s, %s, %s, %s, %s, %s, %s, %s, %s)')
+        params.extend([
+            interval.url,
+            interval.favicon_url,
+            interval.start_time,
+            interval.end_time,
+            interval.date,
+            interval.user_id,
+            interval.hostname,
+            interval.fingerprint,
+            updated_at,
+        ])
+
+    # Без цели конфликта: после секционирования уникален (fingerprint, date)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (url, favicon_url, start_time, end_time, date, user_id, hostname, fingerprint, updated_at)
+            VALUES {', '.join(rows)}
+            ON CONFLICT DO NOTHING
+            RETURNING id, fingerprint
+            """,
+            params,
+        )
+        inserted = dict((fingerprint, pk) for pk, fingerprint in cursor.fetchall())
+
+    new_intervals = []
+    for interval in intervals:
+        if interval.fingerprint in inserted:
+            interval.pk = inserted[interval.fingerprint]
+            new_intervals.append(interval)
+    return new_intervals
+
+
+def collect_statistics(intervals):
+    stats_updates = {}
+
+    for interval in intervals:
+        if not interval.hostname:
+            continue
+
+        stats_key = (interval.hostname, interval.date)
+        if stats_key not in stats_updates:
+            stats_updates[stats_key] = {
+                'session_count': 0,
+                'time_count': 0,
+                'favicon_url': None,
+            }
+
+        stats_updates[stats_key]['session_count'] += 1
+        stats_updates[stats_key]['time_count'] += interval.end_time - interval.start_time
+        stats_updates[stats_key]['favicon_url'] = stats_updates[stats_key]['favicon_url'] or interval.favicon_url
+
+    return stats_updates
+
+
+def merge_statistics(stats_updates, user_id):
+    if not stats_updates:
+        return
+
+    table = connection.ops.quote_name(Statistics._meta.db_table)
+    updated_at = timezone.now()
+    rows = []
+    params = []
+    for (url, period_date), data in stats_updates.items():
+        rows.append('(%s, %s, %s, %s, %s, %s, %s)')
+        params.extend([
+            url,
+            data['favicon_url'],
+            data['session_count'],
+            data['time_count'],
+            period_date,
+            user_id,
+            updated_at,
+        ])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (url, favicon_url, session_count, time_count, period_date, user_id, updated_at)
+            VALUES {', '.join(rows)}
+            ON CONFLICT (user_id, url, period_date) DO UPDATE SET
+                session_count = {table}.session_count + EXCLUDED.session_count,
+                time_count = {table}.time_count + EXCLUDED.time_count,
+                favicon_url = COALESCE(EXCLUDED.favicon_url, {table}.favicon_url),
+                updated_at = EXCLUDED.updated_at
+            """,
+            params,
+        )
+
+
+def merge_rollups(rollups, user_id):
+    if not rollups:
+        return
+
+    table = connection.ops.quote_name(StatisticsRollup._meta.db_table)
+    rows = []
+    params = []
+    for (url, period, period_date), data in rollups.items():
+        rows.append('(%s, %s, %s, %s, %s, %s, %s)')
+        params.extend([
+            url,
+            data['favicon_url'],
+            data['session_count'],
+            data['time_count'],
+            period,
+            period_date,
+            user_id,
+        ])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (url, favicon_url, session_count, time_count, period, period_date, user_id)
+            VALUES {', '.join(rows)}
+            ON CONFLICT (user_id, period, period_date, url) DO UPDATE SET
+                session_count = {table}.session_count + EXCLUDED.session_count,
+                time_count = {table}.time_count + EXCLUDED.time_count,
+                favicon_url = COALESCE(EXCLUDED.favicon_url, {table}.favicon_url)
+            """,
+            params,
+        )
+
+
+def append_deltas(stats_updates, user_id):
+    StatisticsDelta.objects.bulk_create(
+        StatisticsDelta(
+            url=url,
+            period_date=period_date,
+            favicon_url=data['favicon_url'],
+            session_count=data['session_count'],
+            time_count=data['time_count'],
+            user_id=user_id,
+        )
+        for (url, period_date), data in stats_updates.items()
+    )
+
+
+def save_intervals(items, user):
+    """
+    Сохраняет пакет интервалов за постоянное число запросов:
+    вставка интервалов с пропуском дубликатов и слияние статистики.
+    Возвращает все интервалы пакета и новые из них.
+    """
+    intervals = [build_interval(item, user) for item in items]
+
+    # Повторы внутри пакета отбрасываются до вставки
+    unique_intervals = {}
+    for interval in intervals:
+        unique_intervals.setdefault(interval.fingerprint, interval)
+    new_intervals = insert_intervals(list(unique_intervals.values()))
+
+    # Статистика считается только по действительно вставленным строкам
+    stats_updates = collect_statistics(new_intervals)
+    if settings.STATISTICS_DELTAS:
+        # Только вставка без блокировок строк статистики; приращения
+        # сворачиваются командой compact_statistics
+        append_deltas(stats_updates, user.pk)
+    else:
+        merge_statistics(stats_updates, user.pk)
+        merge_rollups(collect_rollups(stats_updates), user.pk)
+
+    # Версии меняются только после фиксации, иначе параллельное чтение
+    # могло бы сохранить в кэш старые данные под новой версией
+    dates = {period_date for url, period_date in stats_updates}
+    transaction.on_commit(lambda: response_cache.bump_versions(user.pk, dates))
+
+    return intervals, new_intervals
+
+
+def ingest_intervals(items, user):
+    """
+    Сохраняет пакет интервалов и возвращает количество
+    обработанных интервалов и дубликатов.
+    """
+    intervals, new_intervals = save_intervals(items, user)
+    return len(intervals), len(intervals) - len(new_intervals)
+
+
+def enqueue_intervals(items, user):
+    """
+    Проверяет пакет без обращения к базе и сохраняет его в очередь
+    одним запросом. Дубликаты и статистика обрабатываются позже
+    командой process_interval_batches.
+    """
+    items = list(items)
+    for item in items:
+        build_interval(item, user)
+
+    return IntervalBatch.objects.create(user=user, payload=items)
+
+
+def process_batches(limit):
+    """
+    Обрабатывает до limit ожидающих пакетов: пакеты одного пользователя
+    сливаются и сохраняются одним проходом ingest_intervals.
+    Пакеты, заблокированные другим обработчиком, пропускаются.
+    Возвращает количество обработанных пакетов.
+    """
+    with transaction.atomic():
+        batches = list(
+            IntervalBatch.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .select_related('user')
+            .order_by('id')[:limit]
+        )
+
+        batches_by_user = {}
+        for batch in batches:
+            batches_by_user.setdefault(batch.user_id, []).append(batch)
+
+        now = timezone.now()
+        for user_batches in batches_by_user.values():
+            user = user_batches[0].user
+            items = [item for batch in user_batches for item in batch.payload]
+            try:
+                with transaction.atomic():
+                    intervals, new_intervals = save_intervals(items, user)
+            except (KeyError, ValidationError, DatabaseError) as e:
+                # Вложенный atomic - точка сохранения: после ее отката
+                # транзакция остается рабочей для остальных пользователей
+                for batch in user_batches:
+                    batch.error = str(e)
+                    batch.processed_at = now
+                continue
+
+            new_ids = {id(interval) for interval in new_intervals}
+            offset = 0
+            for batch in user_batches:
+                batch_intervals = intervals[offset:offset + len(batch.payload)]
+                offset += len(batch.payload)
+                batch.processed = len(batch_intervals)
+                batch.duplicates = sum(1 for interval in batch_intervals if id(interval) not in new_ids)
+                batch.processed_at = now
+
+        IntervalBatch.objects.bulk_update(batches, ['processed_at', 'processed', 'duplicates', 'error'])
+
+    return len(batches)
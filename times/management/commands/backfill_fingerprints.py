@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from times.models import TimeInterval
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет отпечатки интервалов, сохраненных до появления поля fingerprint. "
+        "Точные повторы уже заполненных интервалов остаются без отпечатка и "
+        "выводятся в отчете; с --delete-duplicates они удаляются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--delete-duplicates', action='store_true', help="Удалить точные повторы интервалов")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        total = 0
+        duplicates = []
+
+        while True:
+            with transaction.atomic():
+                intervals = list(
+                    TimeInterval.objects.filter(pk__gt=last_pk, fingerprint__isnull=True)
+                    .order_by('pk')
+                    .only('pk', 'user_id', 'url', 'date', 'start_time', 'end_time')[:chunk_size]
+                )
+                if not intervals:
+                    break
+
+                last_pk = intervals[-1].pk
+                unique, chunk_duplicates = self.split_duplicates(intervals)
+                TimeInterval.objects.bulk_update(unique, ['fingerprint'])
+                if options['delete_duplicates'] and chunk_duplicates:
+                    TimeInterval.objects.filter(pk__in=chunk_duplicates).delete()
+
+            total += len(unique)
+            duplicates.extend(chunk_duplicates)
+            self.stdout.write(f"Заполнено отпечатков: {total}, повторов: {len(duplicates)}")
+
+        if duplicates and options['delete_duplicates']:
+            self.stdout.write(f"Удалено повторов: {len(duplicates)}")
+        elif duplicates:
+            self.stdout.write(self.style.WARNING(
+                f"Повторы без отпечатка ({len(duplicates)}): {', '.join(map(str, duplicates[:100]))}"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Готово, заполнено отпечатков: {total}"))
+
+    def split_duplicates(self, intervals):
+        """
+        Интервалы порции с уникальными отпечатками и ключи повторов: более
+        поздних в порции и совпадающих с уже заполненными отпечатками
+        """
+        by_fingerprint = {}
+        duplicates = []
+        for interval in intervals:
+            interval.fingerprint = interval.get_fingerprint()
+            if interval.fingerprint in by_fingerprint:
+                duplicates.append(interval.pk)
+            else:
+                by_fingerprint[interval.fingerprint] = interval
+
+        existing = TimeInterval.objects.filter(fingerprint__in=list(by_fingerprint)).values_list('fingerprint', flat=True)
+        for fingerprint in existing:
+            duplicates.append(by_fingerprint.pop(fingerprint).pk)
+        return list(by_fingerprint.values()), duplicates
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from utils.hostname import get_hostname
+from times.models import TimeInterval
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет хост у интервалов, сохраненных до появления поля hostname. "
+        "Обход идет по первичному ключу порциями; прерванный запуск можно "
+        "продолжить с последнего выведенного ключа через --start-pk"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--start-pk', type=int, default=0)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = options['start_pk']
+        total = 0
+        max_length = TimeInterval._meta.get_field('hostname').max_length
+
+        while True:
+            with transaction.atomic():
+                intervals = list(
+                    TimeInterval.objects.filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .only('pk', 'url', 'hostname')[:chunk_size]
+                )
+                if not intervals:
+                    break
+
+                last_pk = intervals[-1].pk
+                changed = []
+                for interval in intervals:
+                    hostname = get_hostname(interval.url)
+                    # Такие хосты не принимаются при записи и не помещаются в поле
+                    if hostname and len(hostname) > max_length:
+                        hostname = None
+                    if interval.hostname != hostname:
+                        interval.hostname = hostname
+                        changed.append(interval)
+                TimeInterval.objects.bulk_update(changed, ['hostname'])
+
+            total += len(changed)
+            self.stdout.write(f"Последний ключ: {last_pk}, обновлено: {total}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово, обновлено интервалов: {total}"))
@@ -0,0 +1,64 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+# Режимы: CONN_MAX_AGE и CONN_HEALTH_CHECKS
+MODES = [
+    ('новое соединение на запрос', 0, False),
+    ('постоянное соединение', 60, False),
+    ('постоянное с проверкой', 60, True),
+]
+
+
+def request_cycle(connection):
+    """
+    Один запрос глазами базы: Django закрывает устаревшие соединения по
+    сигналам request_started и request_finished, между ними - один запрос.
+    """
+    close_old_connections()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает накладные расходы на соединение с базой: новое соединение "
+        "на каждый запрос (CONN_MAX_AGE=0) против постоянного соединения с "
+        "проверкой и без. Работает с базой из настроек, в том числе с SQLite"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        saved = {key: connection.settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        self.stdout.write(f"{connection.vendor}, запросов в режиме: {options['requests']}")
+
+        baseline = None
+        try:
+            for name, max_age, health_checks in MODES:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                connection.settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+                request_cycle(connection)
+
+                timings = []
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    request_cycle(connection)
+                    timings.append(time.perf_counter() - started)
+
+                median = statistics.median(timings) * 1000
+                baseline = baseline or median
+                self.stdout.write(
+                    f"{name:>28}: медиана {median:7.3f} мс, "
+                    f"всего {sum(timings):6.2f} с, x{baseline / median:.1f}"
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.update(saved)
@@ -0,0 +1,67 @@
+import json
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from django.core.validators import URLValidator
+from times.validators import BROWSER_URL_SCHEMES, BrowserURLValidator, is_browser_url
+
+
+def make_payload(items, sites, seed=0):
+    """
+    Ссылки и иконки пакета расширения: несколько сайтов с разными страницами,
+    большая часть времени приходится на первые сайты
+    """
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, sites + 1)]
+    values = []
+    for _ in range(items):
+        site = rng.choices(range(sites), weights)[0]
+        values.append(f'https://www.site{site}.com/articles/{rng.randrange(5)}?utm_source=feed')
+        values.append(f'https://www.site{site}.com/favicon.ico')
+    values.append('chrome://extensions/')
+    # Строки разбираются из JSON заново для каждого запроса
+    return json.dumps(values)
+
+
+class Command(BaseCommand):
+    help = "Измеряет время проверки ссылок интервалов валидатором BrowserURLValidator"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=500, help="Интервалов в пакете")
+        parser.add_argument('--sites', type=int, default=20, help="Разных сайтов в пакете")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        payload = make_payload(options['items'], options['sites'])
+        count = len(json.loads(payload))
+
+        full_validator = URLValidator(schemes=BROWSER_URL_SCHEMES)
+        browser_validator = BrowserURLValidator()
+
+        def run_full():
+            for value in json.loads(payload):
+                try:
+                    full_validator(value)
+                except Exception:
+                    pass
+
+        def run_cold():
+            is_browser_url.cache_clear()
+            for value in json.loads(payload):
+                browser_validator(value)
+
+        def run_warm():
+            for value in json.loads(payload):
+                browser_validator(value)
+
+        def run_parse():
+            json.loads(payload)
+
+        parse_time = min(timeit.repeat(run_parse, number=1, repeat=options['repeat']))
+        for name, func in (('URLValidator', run_full), ('BrowserURLValidator, пустой кэш', run_cold), ('BrowserURLValidator', run_warm)):
+            total = min(timeit.repeat(func, number=1, repeat=options['repeat'])) - parse_time
+            self.stdout.write(f"{name}: {total / count * 1e6:.2f} мкс на ссылку")
+
+        run_cold()
+        info = is_browser_url.cache_info()
+        self.stdout.write(f"Ссылок в пакете: {count}, попаданий в кэш: {info.hits}, промахов: {info.misses}")
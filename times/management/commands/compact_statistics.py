@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from times.deltas import compact_deltas
+
+
+class Command(BaseCommand):
+    help = "Сворачивает приращения статистики в Statistics и сводную статистику"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Сколько приращений сворачивать за один проход")
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, ожидая новые приращения")
+        parser.add_argument('--sleep', type=float, default=5.0, help="Пауза при пустой таблице приращений, с")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = compact_deltas(options['batch_size'])
+            total += count
+            if count:
+                self.stdout.write(f"Свернуто приращений: {total}")
+                continue
+
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Готово, свернуто приращений: {total}"))
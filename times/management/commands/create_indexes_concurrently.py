@@ -0,0 +1,156 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.ddl_references import Table
+from times.indexes import ConcurrentIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит индексы ConcurrentIndex приложения times через "
+        "CREATE INDEX CONCURRENTLY, не блокируя запись. Запускается перед migrate"
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("CREATE INDEX CONCURRENTLY поддерживается только в PostgreSQL")
+
+        tables = connection.introspection.table_names()
+        with connection.schema_editor(atomic=False, collect_sql=False) as schema_editor:
+            for model in apps.get_app_config('times').get_models():
+                # Таблицы, которых еще нет, создаст migrate вместе с индексами
+                if model._meta.db_table not in tables:
+                    continue
+
+                partitions = self.get_partitions(model._meta.db_table)
+                columns = self.get_columns(model._meta.db_table)
+                existing = self.get_indexes(model._meta.db_table)
+                for index in model._meta.indexes:
+                    if not isinstance(index, ConcurrentIndex):
+                        continue
+
+                    # Индекс по столбцу, который еще добавит migrate, создаст она же
+                    missing = [
+                        column for column in self.get_index_columns(model, index) if column not in columns
+                    ]
+                    if missing:
+                        self.stdout.write(
+                            f"{model._meta.db_table}: {index.name} пропущен, нет столбцов {', '.join(missing)}"
+                        )
+                        continue
+
+                    # Тот же индекс под прежним именем переименует migrate
+                    renamed = [
+                        name for name, definition in existing.items()
+                        if name != index.name and definition == self.get_index_definition(model, index)
+                    ]
+                    if renamed:
+                        self.stdout.write(
+                            f"{model._meta.db_table}: {index.name} пропущен, уже есть как {renamed[0]}"
+                        )
+                        continue
+
+                    self.stdout.write(f"{model._meta.db_table}: {index.name}")
+                    if partitions:
+                        self.create_partitioned(schema_editor, model, index, partitions)
+                    else:
+                        self.drop_invalid(schema_editor, [index.name])
+                        schema_editor.execute(index.create_sql(model, schema_editor, concurrently=True))
+
+        self.stdout.write(self.style.SUCCESS("Готово"))
+
+    def get_columns(self, table):
+        with connection.cursor() as cursor:
+            return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+    def get_index_columns(self, model, index):
+        return [model._meta.get_field(field_name.lstrip('-')).column for field_name in index.fields]
+
+    def get_index_definition(self, model, index):
+        orders = ['DESC' if field_name.startswith('-') else 'ASC' for field_name in index.fields]
+        return self.get_index_columns(model, index), orders
+
+    def get_indexes(self, table):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        return {
+            name: (constraint['columns'], constraint['orders'])
+            for name, constraint in constraints.items()
+            if constraint['index'] and not constraint['unique'] and not constraint['primary_key']
+        }
+
+    def drop_invalid(self, schema_editor, names):
+        """
+        Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID:
+        планировщик его не использует, а IF NOT EXISTS считает построенным.
+        Такие индексы удаляются, чтобы их построили заново.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT class.relname
+                FROM pg_index
+                JOIN pg_class class ON class.oid = pg_index.indexrelid
+                WHERE class.relname = ANY(%s) AND NOT pg_index.indisvalid
+                """,
+                [list(names)],
+            )
+            invalid = [row[0] for row in cursor.fetchall()]
+        for name in invalid:
+            self.stdout.write(f"{name}: недостроен (INVALID), строится заново")
+            schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}")
+
+    def get_partitions(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s AND parent.relkind = 'p'
+                """,
+                [table],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def create_partitioned(self, schema_editor, model, index, partitions):
+        """
+        На секционированной таблице CONCURRENTLY недоступен: индекс создается
+        только на родителе (ON ONLY), строится конкурентно на каждой партиции
+        и присоединяется к родительскому.
+        """
+        quote = schema_editor.quote_name
+        statement = index.create_sql(model, schema_editor)
+        statement.template = statement.template.replace(' ON %(table)s', ' ON ONLY %(table)s', 1)
+        schema_editor.execute(statement)
+
+        attached = self.get_attached(index.name)
+        children = {
+            partition: schema_editor._create_index_name(partition, [index.name], suffix='idx')
+            for partition in partitions
+        }
+        self.drop_invalid(schema_editor, [name for name in children.values() if name not in attached])
+        for partition, child_name in children.items():
+            if child_name in attached:
+                continue
+
+            statement = index.create_sql(model, schema_editor, concurrently=True)
+            statement.parts['table'] = Table(partition, quote)
+            statement.parts['name'] = quote(child_name)
+            schema_editor.execute(statement)
+            schema_editor.execute(f"ALTER INDEX {quote(index.name)} ATTACH PARTITION {quote(child_name)}")
+
+    def get_attached(self, index_name):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+                """,
+                [index_name],
+            )
+            return {row[0] for row in cursor.fetchall()}
@@ -0,0 +1,89 @@
+import random
+from datetime import date, timedelta
+from itertools import accumulate
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from times.ingest import ingest_intervals
+from users.models import CustomUser
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+def zipf_hosts(count, exponent):
+    """Хосты и накопленные веса: доля времени на сайте убывает как 1 / rank^s"""
+    hosts = [f'www.site{rank}.com' for rank in range(1, count + 1)]
+    weights = [1 / rank ** exponent for rank in range(1, count + 1)]
+    return hosts, list(accumulate(weights))
+
+
+def make_day(rng, day, hosts, cum_weights, intervals):
+    """
+    Интервалы одного дня, как их присылает расширение: подряд с короткими
+    паузами, начиная с утра. Длительности в основном короткие, изредка
+    длинные; страницы хоста повторяются.
+    """
+    items = []
+    position = rng.randint(7 * 3600, 10 * 3600)
+    for _ in range(rng.randint(intervals // 2, intervals * 3 // 2)):
+        duration = min(int(rng.lognormvariate(3.5, 1.2)) + 1, 3600)
+        if position + duration >= SECONDS_PER_DAY:
+            break
+
+        host = rng.choices(hosts, cum_weights=cum_weights)[0]
+        items.append({
+            'startTime': position,
+            'endTime': position + duration,
+            'date': day.isoformat(),
+            'url': f'https://{host}/page/{rng.randrange(20)}',
+            'faviconUrl': f'https://{host}/favicon.ico',
+        })
+        position += duration + int(rng.expovariate(1 / 30))
+    return items
+
+
+class Command(BaseCommand):
+    help = (
+        "Создает синтетические данные для замеров: пользователей с токенами и "
+        "интервалы за несколько месяцев по хостам с распределением Ципфа. "
+        "Интервалы сохраняются через ingest_intervals, как при загрузке, "
+        "поэтому статистика и сводки заполняются тем же путем. "
+        "С тем же --seed данные повторяются; повторный запуск не создает дублей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--hosts', type=int, default=200, help="Разных хостов")
+        parser.add_argument('--zipf', type=float, default=1.1, help="Показатель распределения Ципфа")
+        parser.add_argument('--months', type=int, default=3, help="Месяцев данных (по 30 дней)")
+        parser.add_argument('--start', type=date.fromisoformat, default=date(2025, 1, 1))
+        parser.add_argument('--intervals-per-day', type=int, default=150)
+        parser.add_argument('--email-prefix', default='bench')
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        hosts, cum_weights = zipf_hosts(options['hosts'], options['zipf'])
+        days = [options['start'] + timedelta(days=i) for i in range(options['months'] * 30)]
+        total = 0
+
+        for number in range(options['users']):
+            email = f"{options['email_prefix']}{number}@example.com"
+            user = CustomUser.objects.filter(email=email).first()
+            if user is None:
+                user = CustomUser.objects.create_user(email=email, password=options['password'])
+            token, _ = Token.objects.get_or_create(user=user)
+
+            # Свой генератор на пользователя: его данные не зависят от --users
+            rng = random.Random(f"{options['seed']}:{number}")
+            created = 0
+            for day in days:
+                items = make_day(rng, day, hosts, cum_weights, options['intervals_per_day'])
+                with transaction.atomic():
+                    processed, duplicates = ingest_intervals(items, user)
+                created += processed - duplicates
+
+            total += created
+            self.stdout.write(f"{email}: новых интервалов {created}, токен {token.key}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово, новых интервалов: {total}"))
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import statistics
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand
+
+
+def make_batch(size, offset):
+    """Пакет интервалов, как его присылает расширение раз в несколько секунд"""
+    day = date(2025, 1, 1) + timedelta(days=offset % 28)
+    return json.dumps({'intervals': [
+        {
+            'startTime': (offset * size + i) * 10 % 86000 + 1,
+            'endTime': (offset * size + i) * 10 % 86000 + 6,
+            'date': day.isoformat(),
+            'url': f'https://site{i % 7}.com/page',
+            'faviconUrl': f'https://site{i % 7}.com/favicon.ico',
+        }
+        for i in range(size)
+    ]}).encode()
+
+
+async def send(url, method, token, body, upload_delay):
+    """
+    Один запрос по HTTP/1.1 без сторонних клиентов. При upload_delay тело
+    отправляется частями с паузами, как у клиента на медленном канале.
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    head = (
+        f'{method} {path} HTTP/1.1\r\n'
+        f'Host: {parts.netloc}\r\n'
+        f'Authorization: Token {token}\r\n'
+        f'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Connection: close\r\n\r\n'
+    )
+    writer.write(head.encode())
+    if upload_delay and body:
+        step = len(body) // 4 + 1
+        for start in range(0, len(body), step):
+            writer.write(body[start:start + step])
+            await writer.drain()
+            await asyncio.sleep(upload_delay)
+    else:
+        writer.write(body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def run_level(options, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(options['requests']))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            body = make_batch(options['batch_size'], number) if options['method'] == 'POST' else b''
+            started = time.perf_counter()
+            try:
+                code = await send(options['url'], options['method'], options['token'], body, options['upload_delay'])
+            except OSError:
+                code = 0
+            latencies.append(time.perf_counter() - started)
+            if code >= 400 or code == 0:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест запущенного сервера: запросы с возрастающим числом "
+        "одновременных клиентов. Сравните один синхронный воркер gunicorn и "
+        "один воркер uvicorn, чтобы увидеть, сколько запросов держит процесс"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/create_intervals/')
+        parser.add_argument('--method', default='POST', choices=['GET', 'POST'])
+        parser.add_argument('--token', required=True)
+        parser.add_argument('--concurrency', default='1,8,32,64', help="Уровни одновременности через запятую")
+        parser.add_argument('--requests', type=int, default=200, help="Запросов на каждом уровне")
+        parser.add_argument('--batch-size', type=int, default=20, help="Интервалов в пакете POST")
+        parser.add_argument('--upload-delay', type=float, default=0.0, help="Пауза между частями тела запроса, с")
+
+    def handle(self, *args, **options):
+        for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+            result = asyncio.run(run_level(options, concurrency))
+            self.stdout.write(
+                f"клиентов {result['concurrency']:>4}: {result['rps']:8.1f} запр/с, "
+                f"p50 {result['p50']:7.1f} мс, p95 {result['p95']:7.1f} мс, ошибок {result['errors']}"
+            )
@@ -0,0 +1,51 @@
+from datetime import date, datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from times.partitions import (
+    add_months,
+    convert_to_partitioned,
+    detach_partitions,
+    ensure_partitions,
+    is_partitioned,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Обслуживает помесячные партиции таблицы интервалов: перевод таблицы "
+        "на секционирование, создание будущих партиций и отсоединение старых"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help="Перевести таблицу на секционирование (блокирует таблицу)")
+        parser.add_argument('--ahead', type=int, default=3, help="На сколько месяцев вперед создавать партиции")
+        parser.add_argument('--detach-before', help="Отсоединить партиции месяцев, закончившихся до даты YYYY-MM-DD")
+        parser.add_argument('--drop', action='store_true', help="Удалять отсоединенные партиции вместо архивирования")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Секционирование поддерживается только в PostgreSQL")
+
+        detach_before = None
+        if options['detach_before']:
+            try:
+                detach_before = datetime.strptime(options['detach_before'], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Неверный формат даты. Используйте YYYY-MM-DD")
+
+        if options['convert']:
+            for name in convert_to_partitioned(options['ahead']):
+                self.stdout.write(f"Создана партиция {name}")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("Таблица интервалов не секционирована, запустите команду с --convert")
+
+            for name in ensure_partitions(cursor, add_months(date.today(), options['ahead'])):
+                self.stdout.write(f"Создана партиция {name}")
+
+            if detach_before:
+                for name in detach_partitions(cursor, detach_before, drop=options['drop']):
+                    self.stdout.write(f"Отсоединена партиция {name}")
+
+        self.stdout.write(self.style.SUCCESS("Готово"))
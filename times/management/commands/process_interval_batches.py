@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from times.ingest import process_batches
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает очередь пакетов интервалов, принятых в асинхронном режиме"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Сколько пакетов сливать за один проход")
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, ожидая новые пакеты")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Пауза при пустой очереди, с")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = process_batches(options['batch_size'])
+            total += count
+            if count:
+                self.stdout.write(f"Обработано пакетов: {total}")
+                continue
+
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Готово, обработано пакетов: {total}"))
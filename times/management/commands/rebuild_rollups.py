@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import TruncWeek, TruncMonth
+from times import response_cache
+from times.models import Statistics, StatisticsRollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает недельную и месячную статистику по дневной, по одному "
+        "пользователю в короткой транзакции. Запускается после migrate с "
+        "--stale: пересчитываются только пользователи, у которых суммы сводных "
+        "записей расходятся с дневной статистикой, например после записей "
+        "воркеров старой версии во время развертывания. Команду можно "
+        "повторять в любой момент, в том числе после завершения развертывания"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--stale', action='store_true',
+            help="Только пользователи, чьи сводные записи не сходятся с дневной статистикой",
+        )
+
+    def handle(self, *args, **options):
+        users = self.get_stale_users() if options['stale'] else self.get_users()
+
+        total = 0
+        for user_id in sorted(users):
+            total += self.rebuild_user(user_id, options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово, пользователей: {len(users)}, сводных записей: {total}"
+        ))
+
+    def get_users(self):
+        return (
+            set(Statistics.objects.values_list('user_id', flat=True).distinct())
+            | set(StatisticsRollup.objects.values_list('user_id', flat=True).distinct())
+        )
+
+    def get_stale_users(self):
+        """Пользователи, у которых итоги недель или месяцев не равны итогам дней"""
+        daily = {
+            row['user_id']: (row['sessions'], row['time'])
+            for row in Statistics.objects.values('user_id').annotate(
+                sessions=Sum('session_count'), time=Sum('time_count'),
+            ).order_by()
+        }
+        rollups = {}
+        for row in StatisticsRollup.objects.values('user_id', 'period').annotate(
+            sessions=Sum('session_count'), time=Sum('time_count'),
+        ).order_by():
+            rollups[row['user_id'], row['period']] = (row['sessions'], row['time'])
+
+        users = set(daily) | {user_id for user_id, period in rollups}
+        return {
+            user_id for user_id in users
+            if any(
+                rollups.get((user_id, period)) != daily.get(user_id)
+                for period in (StatisticsRollup.WEEK, StatisticsRollup.MONTH)
+            )
+        }
+
+    @transaction.atomic
+    def rebuild_user(self, user_id, batch_size):
+        if connection.vendor == 'postgresql':
+            # Загрузки ждут пересчета пользователя: их строки Statistics, не
+            # видные ему, попадут в сводные записи уже после него
+            table = connection.ops.quote_name(StatisticsRollup._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+
+        StatisticsRollup.objects.filter(user_id=user_id).delete()
+        transaction.on_commit(lambda: response_cache.bump_generation(user_id))
+
+        total = 0
+        for period, trunc in ((StatisticsRollup.WEEK, TruncWeek), (StatisticsRollup.MONTH, TruncMonth)):
+            rows = Statistics.objects.filter(user_id=user_id).annotate(
+                period_start=trunc('period_date'),
+            ).values('url', 'period_start').annotate(
+                favicon=Max('favicon_url'),
+                sessions=Sum('session_count'),
+                time=Sum('time_count'),
+            ).order_by()
+
+            rollups = StatisticsRollup.objects.bulk_create(
+                (
+                    StatisticsRollup(
+                        user_id=user_id,
+                        url=row['url'],
+                        favicon_url=row['favicon'],
+                        session_count=row['sessions'],
+                        time_count=row['time'],
+                        period=period,
+                        period_date=row['period_start'],
+                    )
+                    for row in rows.iterator()
+                ),
+                batch_size=batch_size,
+            )
+            total += len(rollups)
+
+        return total
@@ -0,0 +1,194 @@
+import json
+import statistics
+import subprocess
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from times.models import TimeInterval
+from users.models import CustomUser
+
+# Даты пакетов замера create_intervals не пересекаются с синтетическими
+INGEST_START = date(2000, 1, 1)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000,
+    }
+
+
+def make_batch(size, number):
+    """Пакет без дублей: у каждого пакета свой день"""
+    day = INGEST_START + timedelta(days=number)
+    return json.dumps({'intervals': [
+        {
+            'startTime': i * 10 % 86000 + 1,
+            'endTime': i * 10 % 86000 + 6,
+            'date': day.isoformat(),
+            'url': f'https://www.site{i % 50 + 1}.com/page/{i % 20}',
+            'faviconUrl': f'https://www.site{i % 50 + 1}.com/favicon.ico',
+        }
+        for i in range(size)
+    ]})
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(metrics, baseline, threshold):
+    """Метрики, ухудшившиеся относительно baseline больше чем на threshold"""
+    regressions = []
+    for name, metric in metrics.items():
+        previous = baseline.get(name)
+        if not previous or not previous['value']:
+            continue
+
+        change = metric['value'] / previous['value'] - 1
+        if metric['better'] == 'higher':
+            change = -change
+        if change > threshold:
+            regressions.append(f"{name}: {previous['value']:.2f} -> {metric['value']:.2f} ({change:+.0%})")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеры на данных generate_synthetic_data: пропускная способность "
+        "create_intervals при разных размерах пакета, задержка статистики за "
+        "периоды разной длины и глубина постраничного вывода интервалов. "
+        "Запросы идут через тестовый клиент в этом процессе; загруженные при "
+        "замере интервалы откатываются. Результат пишется в JSON; с --baseline "
+        "команда завершается ошибкой при регрессии больше --threshold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', default='bench0@example.com', help="Пользователь с синтетическими данными")
+        parser.add_argument('--repeat', type=int, default=20, help="Повторов каждого замера")
+        parser.add_argument('--batch-sizes', default='1,10,100,500')
+        parser.add_argument('--ranges', default='1,7,30,90', help="Длины периодов статистики в днях")
+        parser.add_argument('--depths', default='1,10,100', help="Номера страниц списка интервалов")
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--baseline', help="JSON предыдущего запуска для сравнения")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Допустимое ухудшение, доля")
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"Нет пользователя {options['email']}, сначала запустите generate_synthetic_data")
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.repeat = options['repeat']
+
+        metrics = {}
+        # Замеряется обращение к базе, а не кэш ответов статистики
+        with override_settings(STATISTICS_CACHE_ALIAS=None):
+            for size in self.parse_list(options['batch_sizes']):
+                metrics.update(self.measure_ingest(size))
+            last_date = TimeInterval.objects.filter(user=user, date__gt=INGEST_START).aggregate(last=Max('date'))['last']
+            if last_date is None:
+                raise CommandError(f"У {options['email']} нет интервалов, сначала запустите generate_synthetic_data")
+            for days in self.parse_list(options['ranges']):
+                metrics.update(self.measure_statistics(last_date, days))
+            for depth in self.parse_list(options['depths']):
+                metrics.update(self.measure_listing(depth))
+
+        result = {
+            'created': timezone.now().isoformat(),
+            'commit': current_commit(),
+            'database': connection.vendor,
+            'repeat': self.repeat,
+            'metrics': metrics,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
+
+        for name, metric in metrics.items():
+            self.stdout.write(f"{name:>50}: {metric['value']:10.2f}")
+        self.stdout.write(f"Результат записан в {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['metrics']
+            regressions = find_regressions(metrics, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Регрессия относительно baseline:\n" + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS("Регрессий нет"))
+
+    def parse_list(self, value):
+        return [int(item) for item in value.split(',')]
+
+    def timed(self, request):
+        started = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError(f"Ответ {response.status_code}: {response.content[:200]!r}")
+        return elapsed, response
+
+    def measure_ingest(self, size):
+        batches = [make_batch(size, number) for number in range(self.repeat)]
+        timings = []
+        # Пакеты сохраняются внутри внешней транзакции и откатываются,
+        # поэтому повторные запуски идут на одинаковых данных
+        with transaction.atomic():
+            for batch in batches:
+                elapsed, _ = self.timed(lambda: self.client.post(
+                    '/api/create_intervals/', data=batch, content_type='application/json',
+                ))
+                timings.append(elapsed)
+            transaction.set_rollback(True)
+
+        name = f'create_intervals.batch_{size}'
+        return {
+            f'{name}.intervals_per_second': {'value': size * len(timings) / sum(timings), 'better': 'higher'},
+            f'{name}.p50_ms': {'value': summarize(timings)['p50_ms'], 'better': 'lower'},
+        }
+
+    def measure_statistics(self, last_date, days):
+        params = {
+            'period_date_start': (last_date - timedelta(days=days - 1)).isoformat(),
+            'period_date_end': last_date.isoformat(),
+        }
+        timings = [
+            self.timed(lambda: self.client.get('/api/statistics/', params))[0]
+            for _ in range(self.repeat)
+        ]
+        summary = summarize(timings)
+        return {
+            f'statistics_range.days_{days}.{key}': {'value': value, 'better': 'lower'}
+            for key, value in summary.items()
+        }
+
+    def measure_listing(self, depth):
+        """Страница depth по номеру (OFFSET) и по курсору"""
+        offset_timings = [
+            self.timed(lambda: self.client.get('/api/intervals/', {'page': depth}))[0]
+            for _ in range(self.repeat)
+        ]
+
+        url = '/api/intervals/?pagination=cursor'
+        for _ in range(depth - 1):
+            url = self.client.get(url).json()['next']
+            if url is None:
+                raise CommandError(f"Интервалов меньше, чем на {depth} страниц")
+        cursor_timings = [self.timed(lambda: self.client.get(url))[0] for _ in range(self.repeat)]
+
+        return {
+            f'intervals_list.page_{depth}.offset_p50_ms': {'value': summarize(offset_timings)['p50_ms'], 'better': 'lower'},
+            f'intervals_list.page_{depth}.cursor_p50_ms': {'value': summarize(cursor_timings)['p50_ms'], 'better': 'lower'},
+        }
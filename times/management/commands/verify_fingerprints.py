@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from times.models import TimeInterval
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает отпечатки интервалов и сообщает о расхождениях"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--fix', action='store_true', help="Исправить неверные отпечатки")
+
+    def handle(self, *args, **options):
+        queryset = TimeInterval.objects.order_by('pk').only(
+            'pk', 'user_id', 'url', 'date', 'start_time', 'end_time', 'fingerprint'
+        )
+
+        checked = 0
+        mismatched = []
+        for interval in queryset.iterator(chunk_size=options['chunk_size']):
+            checked += 1
+            expected = interval.get_fingerprint()
+            if interval.fingerprint != expected:
+                interval.fingerprint = expected
+                mismatched.append(interval)
+
+        if mismatched and options['fix']:
+            TimeInterval.objects.bulk_update(mismatched, ['fingerprint'], batch_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"Проверено: {checked}, исправлено: {len(mismatched)}"))
+        elif mismatched:
+            raise CommandError(f"Проверено: {checked}, неверных отпечатков: {len(mismatched)}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Проверено: {checked}, расхождений нет"))
@@ -1,22 +1,16 @@
+import hashlib
 from django.db import models
-from django.db.models import Value, F, Func
 from django.forms import ValidationError
 from utils.ms_to_time import ms_to_time
+from utils.hostname import get_hostname
 from .validators import BrowserURLValidator
-from urllib.parse import urlparse
+from .indexes import ConcurrentIndex
 from users.models import CustomUser
 
 
 class TimeIntervalManager(models.Manager):
     def filter_by_hostname(self, hostname):
-        return self.annotate(
-            url_hostname=Func(
-                F('url'),
-                Value(r'^(?:https?://)?([^/]+)'),
-                function='SUBSTRING',
-                output_field=models.CharField()
-            )
-        ).filter(url_hostname=hostname)
+        return self.filter(hostname=hostname)
 
 
 class TimeInterval(models.Model):
@@ -25,10 +19,26 @@ class TimeInterval(models.Model):
     start_time = models.PositiveIntegerField(verbose_name="Время начала (с)")
     end_time = models.PositiveIntegerField(verbose_name="Время окончания (с)")
     date = models.DateField(verbose_name="Дата")
-    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
+    hostname = models.CharField(max_length=255, null=True, blank=True, editable=False, verbose_name="Хост")
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False, verbose_name="Отпечаток")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменен")
     
     objects = TimeIntervalManager()
 
+    @staticmethod
+    def make_fingerprint(user_id, url, date, start_time, end_time):
+        value = f"{user_id}|{url}|{date}|{start_time}|{end_time}"
+        return hashlib.sha256(value.encode()).hexdigest()
+
+    def get_fingerprint(self):
+        return self.make_fingerprint(self.user_id, self.url, self.date, self.start_time, self.end_time)
+
+    def save(self, *args, **kwargs):
+        self.hostname = get_hostname(self.url)
+        self.fingerprint = self.get_fingerprint()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.url} [{self.date}]: {ms_to_time(self.start_time)}-{ms_to_time(self.end_time)}"
     
@@ -38,6 +48,10 @@ class TimeInterval(models.Model):
             raise ValidationError("Время начала интервала - обязательное поле")
         if not self.end_time:
             raise ValidationError("Время конца интервала - обязательное поле")
+
+        hostname = get_hostname(self.url)
+        if hostname and len(hostname) > self._meta.get_field('hostname').max_length:
+            raise ValidationError({'url': "Слишком длинное имя хоста"})
         
         if self.start_time >= self.end_time:
             raise ValidationError({
@@ -49,7 +63,17 @@ class TimeInterval(models.Model):
         verbose_name_plural = "Интервалы"
         ordering = ['-date', 'start_time']
         indexes = [
-            models.Index(fields=['date', 'start_time']),
+            ConcurrentIndex(fields=['user', '-date', 'start_time', 'id'], name='times_interval_user_keyset_idx'),
+            ConcurrentIndex(fields=['user', 'hostname', 'date'], name='times_interval_user_host_idx'),
+            ConcurrentIndex(fields=['user', 'updated_at', 'id'], name='times_interval_user_sync_idx'),
+        ]
+        # Уникальные ключи секционированной таблицы (partition_intervals
+        # --convert) обязаны включать дату секционирования, поэтому
+        # отпечаток уникален вместе с ней. Дата входит в отпечаток, так что
+        # это та же уникальность отпечатка. Первичный ключ там (id, date);
+        # Django его не описывает и продолжает считать ключом id
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'], name='times_timeinterval_fingerprint_key'),
         ]
 
 
@@ -59,17 +83,18 @@ class Statistics(models.Model):
     session_count = models.PositiveIntegerField(default=0, verbose_name="Количество сессий")
     time_count = models.PositiveIntegerField(default=0, verbose_name="Проведенное время (с)")
     period_date = models.DateField(verbose_name="Дата периода")
-    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменена")
     
     @property
-    def intervals(self):        
-        parsed_url = urlparse(self.url)
-        if not parsed_url.hostname:
-            parsed_url = urlparse(f"http://{self.url}")
-            
+    def intervals(self):
+        if hasattr(self, '_prefetched_intervals'):
+            return self._prefetched_intervals
+
         return TimeInterval.objects.filter_by_hostname(
-            parsed_url.hostname
+            get_hostname(self.url)
         ).filter(
+            user_id=self.user_id,
             date=self.period_date
         ).order_by('-date', 'start_time')
     
@@ -77,10 +102,118 @@ class Statistics(models.Model):
         return f"{self.url} [{self.period_date}]"
     
     class Meta:
-        unique_together = ('url', 'period_date')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'url', 'period_date'],
+                name='unique_user_statistics',
+            ),
+        ]
         indexes = [
-            models.Index(fields=['url']),
-            models.Index(fields=['period_date']),
+            ConcurrentIndex(
+                fields=['user', 'period_date', '-time_count'],
+                include=['url', 'session_count'],
+                name='times_stat_user_period_idx',
+            ),
+            ConcurrentIndex(fields=['user', 'updated_at', 'id'], name='times_stat_user_sync_idx'),
         ]
         verbose_name = "Статистика"
         verbose_name_plural = "Статистика"
+
+
+class StatisticsRollup(models.Model):
+    WEEK = 'week'
+    MONTH = 'month'
+    PERIOD_CHOICES = [
+        (WEEK, "Неделя"),
+        (MONTH, "Месяц"),
+    ]
+
+    url = models.CharField(max_length=500, verbose_name="Ссылка на сайт")
+    favicon_url = models.CharField(max_length=500, verbose_name="Ссылка на иконку", null=True, blank=True)
+    session_count = models.PositiveIntegerField(default=0, verbose_name="Количество сессий")
+    time_count = models.PositiveIntegerField(default=0, verbose_name="Проведенное время (с)")
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES, verbose_name="Период")
+    period_date = models.DateField(verbose_name="Начало периода")
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+
+    def __str__(self):
+        return f"{self.url} [{self.get_period_display()} {self.period_date}]"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_date', 'url'],
+                name='unique_statistics_rollup',
+            ),
+        ]
+        verbose_name = "Сводная статистика"
+        verbose_name_plural = "Сводная статистика"
+
+
+class StatisticsDelta(models.Model):
+    """Приращение дневной статистики, еще не свернутое в Statistics"""
+    url = models.CharField(max_length=500, verbose_name="Ссылка на сайт")
+    favicon_url = models.CharField(max_length=500, verbose_name="Ссылка на иконку", null=True, blank=True)
+    session_count = models.PositiveIntegerField(default=0, verbose_name="Количество сессий")
+    time_count = models.PositiveIntegerField(default=0, verbose_name="Проведенное время (с)")
+    period_date = models.DateField(verbose_name="Дата периода")
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+
+    def __str__(self):
+        return f"{self.url} [{self.period_date}]: +{self.time_count}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'period_date']),
+        ]
+        verbose_name = "Приращение статистики"
+        verbose_name_plural = "Приращения статистики"
+
+
+class IntervalBatch(models.Model):
+    """Пакет интервалов, принятый в асинхронном режиме и ожидающий обработки"""
+    user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    payload = models.JSONField(verbose_name="Интервалы")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Получен")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Обработан")
+    processed = models.PositiveIntegerField(null=True, blank=True, verbose_name="Обработано интервалов")
+    duplicates = models.PositiveIntegerField(null=True, blank=True, verbose_name="Дубликатов")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+
+    def __str__(self):
+        return f"{self.user} [{self.created_at}]"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='times_batch_pending_idx'),
+        ]
+        verbose_name = "Пакет интервалов"
+        verbose_name_plural = "Пакеты интервалов"
+
+
+def prefetch_intervals(statistics):
+    """
+    Загружает интервалы для списка статистики одним запросом и
+    раскладывает их по записям по ключу (хост, дата).
+    """
+    statistics = list(statistics)
+    for stat in statistics:
+        stat._prefetched_intervals = []
+
+    if not statistics:
+        return statistics
+
+    stats_by_key = {(get_hostname(stat.url), stat.period_date, stat.user_id): stat for stat in statistics}
+    intervals = TimeInterval.objects.filter(
+        user_id__in={stat.user_id for stat in statistics},
+        hostname__in={key[0] for key in stats_by_key},
+        date__gte=min(stat.period_date for stat in statistics),
+        date__lte=max(stat.period_date for stat in statistics),
+    ).order_by('-date', 'start_time')
+
+    for interval in intervals:
+        stat = stats_by_key.get((interval.hostname, interval.date, interval.user_id))
+        if stat is not None:
+            stat._prefetched_intervals.append(interval)
+
+    return statistics
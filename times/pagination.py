@@ -0,0 +1,90 @@
+import base64
+from datetime import date
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class IntervalPagination(pagination.PageNumberPagination):
+    page_size = 20
+
+
+class IntervalKeysetPagination(pagination.BasePagination):
+    """
+    Постраничный вывод интервалов по ключу (-date, start_time, id) без
+    OFFSET и подсчета общего количества. Курсор следующей страницы
+    кодирует ключ последней строки текущей.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 1000
+    ordering = ('-date', 'start_time', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            last_date, last_start_time, last_id = position
+            queryset = queryset.filter(date__lte=last_date).filter(
+                Q(date__lt=last_date)
+                | Q(date=last_date, start_time__gt=last_start_time)
+                | Q(date=last_date, start_time=last_start_time, id__gt=last_id)
+            )
+
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        results = results[:page_size]
+        self.last = results[-1] if results else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            value = base64.urlsafe_b64decode(encoded.encode()).decode()
+            last_date, last_start_time, last_id = value.split('|')
+            return date.fromisoformat(last_date), int(last_start_time), int(last_id)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, interval):
+        value = f'{interval.date.isoformat()}|{interval.start_time}|{interval.pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,117 @@
+import io
+import json
+import zlib
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+
+try:
+    import zstandard
+    DECOMPRESS_ERRORS = (zlib.error, zstandard.ZstdError)
+except ImportError:
+    zstandard = None
+    DECOMPRESS_ERRORS = (zlib.error,)
+
+
+class DecompressedBodyTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Распакованное тело запроса слишком большое"
+    default_code = 'decompressed_body_too_large'
+
+
+def decompress(data, encoding):
+    """
+    Распаковывает тело запроса по заголовку Content-Encoding.
+    Размер распакованных данных ограничен MAX_DECOMPRESSED_BODY_SIZE.
+    """
+    limit = settings.MAX_DECOMPRESSED_BODY_SIZE
+    try:
+        if encoding == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            result = decompressor.decompress(data, limit + 1 if limit else 0)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise UnsupportedMediaType(encoding, detail="Сжатие zstd не поддерживается сервером")
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+            result = reader.read(limit + 1) if limit else reader.read()
+        else:
+            raise UnsupportedMediaType(encoding, detail=f"Неподдерживаемое сжатие: {encoding}")
+    except DECOMPRESS_ERRORS as e:
+        raise ParseError(f"Invalid compressed body: {e}")
+
+    if limit and len(result) > limit:
+        raise DecompressedBodyTooLarge()
+    return result
+
+
+class DecompressingParserMixin:
+    def read_body(self, stream, parser_context):
+        data = stream.read() if stream is not None else b''
+        request = (parser_context or {}).get('request')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower() if request else ''
+        if encoding and encoding != 'identity':
+            data = decompress(data, encoding)
+        return data
+
+
+class JSONParser(DecompressingParserMixin, parsers.JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = self.read_body(stream, parser_context)
+        return super().parse(io.BytesIO(data), media_type, parser_context)
+
+
+class CompactIntervalsParser(DecompressingParserMixin, parsers.BaseParser):
+    """
+    Колоночный формат пакета интервалов. Ссылки, иконки и даты
+    передаются словарями один раз на пакет, интервалы ссылаются на них
+    по индексу; начало хранится как разница с началом предыдущего
+    интервала, конец - как длительность:
+
+        {
+            "urls": ["https://example.com"],
+            "favicons": ["https://example.com/favicon.ico"],
+            "dates": ["2025-01-01"],
+            "url": [0, 0],
+            "favicon": [0, null],
+            "date": [0, 0],
+            "start": [100, 200],
+            "duration": [100, 50]
+        }
+
+    Разбирается в тот же вид {"intervals": [...]}, что и обычный JSON.
+    """
+    media_type = 'application/vnd.webtime.intervals+json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            data = json.loads(self.read_body(stream, parser_context))
+            return {'intervals': self.decode(data)}
+        except ValueError as e:
+            raise ParseError(f'Invalid JSON: {e}')
+        except (KeyError, IndexError, TypeError) as e:
+            raise ParseError(f'Invalid compact intervals: {e!r}')
+
+    def decode(self, data):
+        urls = data['urls']
+        favicons = data.get('favicons', [])
+        dates = data['dates']
+        columns = [data['url'], data.get('favicon') or [None] * len(data['url']), data['date'], data['start'], data['duration']]
+        if len({len(column) for column in columns}) != 1:
+            raise ParseError("Invalid compact intervals: columns have different lengths")
+
+        intervals = []
+        start_time = 0
+        for url, favicon, date, start_delta, duration in zip(*columns):
+            if min(url, date, favicon if favicon is not None else 0) < 0:
+                raise IndexError("negative index")
+
+            start_time += start_delta
+            intervals.append({
+                'url': urls[url],
+                'faviconUrl': favicons[favicon] if favicon is not None else None,
+                'date': dates[date],
+                'startTime': start_time,
+                'endTime': start_time + duration,
+            })
+        return intervals
@@ -0,0 +1,188 @@
+from datetime import date
+from django.db import connection, transaction
+from .models import TimeInterval
+
+TABLE = TimeInterval._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}_{month.month:02d}'
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(cursor):
+    cursor.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        ORDER BY child.relname
+        """,
+        [TABLE],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_partition(cursor, month):
+    """
+    Создает партицию за месяц, если ее еще нет. Строки этого месяца,
+    попавшие в партицию по умолчанию, переносятся в новую партицию.
+    """
+    name = partition_name(month)
+    if name in list_partitions(cursor):
+        return False
+
+    quote = connection.ops.quote_name
+    bounds = [month, add_months(month, 1)]
+    cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    if DEFAULT_PARTITION in list_partitions(cursor):
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {quote(DEFAULT_PARTITION)}
+                WHERE date >= %s AND date < %s
+                RETURNING *
+            )
+            INSERT INTO {quote(name)} SELECT * FROM moved
+            """,
+            bounds,
+        )
+    cursor.execute(
+        f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)",
+        bounds,
+    )
+    return True
+
+
+def ensure_partitions(cursor, until):
+    """Создает партиции от текущего месяца до месяца until включительно"""
+    created = []
+    month = month_start(date.today())
+    while month <= month_start(until):
+        if ensure_partition(cursor, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(cursor, before, drop=False):
+    """
+    Отсоединяет партиции месяцев, закончившихся до даты before.
+    Отсоединенные таблицы остаются архивом, если не указан drop.
+    """
+    quote = connection.ops.quote_name
+    detached = []
+    prefix = f'{TABLE}_p'
+    for name in list_partitions(cursor):
+        if not name.startswith(prefix):
+            continue
+
+        year, month = name[len(prefix):].split('_')
+        if add_months(date(int(year), int(month), 1), 1) > before:
+            continue
+
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+        if drop:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+        detached.append(name)
+    return detached
+
+
+@transaction.atomic
+def convert_to_partitioned(ahead):
+    """
+    Переводит таблицу интервалов на помесячное секционирование по дате.
+    Таблица блокируется на время копирования данных, поэтому запускать
+    следует в окно обслуживания.
+
+    В секционированной таблице уникальные ключи обязаны содержать дату:
+    первичный ключ становится (id, date). Уникальность отпечатка уже
+    объявлена в модели как (fingerprint, date) и переносится как есть.
+    """
+    quote = connection.ops.quote_name
+    staging = f'{TABLE}_partitioned'
+
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return []
+
+        # Отложенные проверки внешних ключей не дают удалить таблицу
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(f"LOCK TABLE {quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            """
+            SELECT pg_get_indexdef(indexrelid)
+            FROM pg_index
+            WHERE indrelid = %s::regclass AND NOT indisunique
+            """,
+            [TABLE],
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """,
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT MIN(date), MAX(id) FROM {quote(TABLE)}")
+        first_date, max_id = cursor.fetchone()
+
+        cursor.execute(
+            f"""
+            CREATE TABLE {quote(staging)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE (date)
+            """
+        )
+        cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(staging)} DEFAULT")
+
+        created = []
+        month = month_start(first_date or date.today())
+        last = add_months(month_start(date.today()), ahead)
+        while month <= last:
+            cursor.execute(
+                f"CREATE TABLE {quote(partition_name(month))} PARTITION OF {quote(staging)} FOR VALUES FROM (%s) TO (%s)",
+                [month, add_months(month, 1)],
+            )
+            created.append(partition_name(month))
+            month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {quote(staging)} SELECT * FROM {quote(TABLE)}")
+        cursor.execute(f"DROP TABLE {quote(TABLE)}")
+        cursor.execute(f"ALTER TABLE {quote(staging)} RENAME TO {quote(TABLE)}")
+
+        sequence = f'{TABLE}_id_seq'
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(TABLE)}.id")
+        cursor.execute("SELECT setval(%s, %s, false)", [sequence, (max_id or 0) + 1])
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ALTER COLUMN id SET DEFAULT nextval(%s)", [sequence])
+
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(TABLE + '_pkey')} PRIMARY KEY (id, date)")
+        # Ограничения модели уже включают дату, их имена совпадают с созданными migrate
+        for constraint in TimeInterval._meta.constraints:
+            columns = ', '.join(quote(TimeInterval._meta.get_field(name).column) for name in constraint.fields)
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(constraint.name)} UNIQUE ({columns})")
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+
+    return created
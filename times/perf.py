@@ -0,0 +1,233 @@
+"""
+Замеры запросов: время ответа, время в базе, число запросов к базе и
+повторов среди них, отданные строки и размер ответа. PerformanceMiddleware
+замеряет долю PERF_SAMPLE_RATE запросов и отдает замер в Server-Timing,
+суммы по представлениям копятся в процессе и отдаются в формате Prometheus.
+С PERF_PROFILE_DIR замеряемые синхронные запросы идут под cProfile, а
+профили запросов дольше PERF_PROFILE_THRESHOLD_MS сохраняются в каталог.
+"""
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.duplicates = 0
+        self.seen = set()
+        self.rows = 0
+        self.size = 0
+
+    def add_query(self, sql, params, duration):
+        self.queries += 1
+        self.db_time += duration
+        key = (sql, repr(params))
+        if key in self.seen:
+            self.duplicates += 1
+        else:
+            self.seen.add(key)
+
+    def finish(self, response):
+        self.wall_time = time.perf_counter() - self.started
+        self.rows = count_rows(getattr(response, 'data', None))
+        self.size = 0 if response.streaming else len(response.content)
+
+    def server_timing(self):
+        return (
+            f'total;dur={self.wall_time * 1000:.1f}, '
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries, {self.duplicates} duplicates"'
+        )
+
+
+def count_rows(data):
+    """Строки в ответе DRF: элементы списка или страницы results"""
+    if isinstance(data, dict):
+        data = data.get('results')
+    return len(data) if isinstance(data, list) else 0
+
+
+def record_query(execute, sql, params, many, context):
+    """Обертка выполнения запросов; вне замеряемого запроса ничего не делает"""
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, params, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Подключается к connection_created: обертка ставится на каждое соединение,
+    в том числе открытое в потоке sync_to_async под ASGI.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ViewStats:
+    def __init__(self):
+        self.count = 0
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.duplicates = 0
+        self.rows = 0
+        self.size = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, metrics):
+        self.count += 1
+        self.wall_time += metrics.wall_time
+        self.db_time += metrics.db_time
+        self.queries += metrics.queries
+        self.duplicates += metrics.duplicates
+        self.rows += metrics.rows
+        self.size += metrics.size
+        for i, bound in enumerate(BUCKETS):
+            if metrics.wall_time <= bound:
+                self.buckets[i] += 1
+
+
+class Registry:
+    """Суммы замеров по представлениям в пределах процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, view, metrics):
+        with self.lock:
+            self.views.setdefault(view, ViewStats()).add(metrics)
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self, extra=None):
+        """Текстовый формат Prometheus; extra - дополнительные счетчики"""
+        lines = []
+        with self.lock:
+            views = sorted(self.views.items())
+            for name, kind, value in (
+                ('times_requests_total', 'counter', lambda stats: stats.count),
+                ('times_db_seconds_total', 'counter', lambda stats: stats.db_time),
+                ('times_queries_total', 'counter', lambda stats: stats.queries),
+                ('times_duplicate_queries_total', 'counter', lambda stats: stats.duplicates),
+                ('times_rows_serialized_total', 'counter', lambda stats: stats.rows),
+                ('times_response_bytes_total', 'counter', lambda stats: stats.size),
+            ):
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{{view="{view}"}} {value(stats)}' for view, stats in views)
+
+            lines.append('# TYPE times_request_seconds histogram')
+            for view, stats in views:
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    lines.append(f'times_request_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'times_request_seconds_bucket{{view="{view}",le="+Inf"}} {stats.count}')
+                lines.append(f'times_request_seconds_sum{{view="{view}"}} {stats.wall_time}')
+                lines.append(f'times_request_seconds_count{{view="{view}"}} {stats.count}')
+
+        for name, value in (extra or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def sampled():
+    rate = settings.PERF_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def dump_profile(profiler, request, metrics):
+    if metrics.wall_time * 1000 < settings.PERF_PROFILE_THRESHOLD_MS:
+        return
+    os.makedirs(settings.PERF_PROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^\w-]', '_', view_name(request))
+    profiler.dump_stats(os.path.join(
+        settings.PERF_PROFILE_DIR,
+        f'{name}-{time.time_ns()}-{metrics.wall_time * 1000:.0f}ms.prof',
+    ))
+
+
+class PerformanceMiddleware:
+    """
+    Замеряет долю запросов PERF_SAMPLE_RATE; остальные проходят без
+    накладных расходов. Под ASGI профили не снимаются: в одном потоке там
+    чередуются разные запросы.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        profiler = cProfile.Profile() if settings.PERF_PROFILE_DIR else None
+        try:
+            if profiler:
+                profiler.enable()
+            response = self.get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            current_metrics.reset(token)
+
+        self.finish(request, response, metrics)
+        if profiler:
+            dump_profile(profiler, request, metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        self.finish(request, response, metrics)
+        return response
+
+    def finish(self, request, response, metrics):
+        metrics.finish(response)
+        registry.add(view_name(request), metrics)
+        response['Server-Timing'] = metrics.server_timing()
@@ -0,0 +1,105 @@
+"""
+Чтение тяжелых представлений с реплики базы. Представление с
+ReplicaReadMixin читает с REPLICA_DATABASE, если реплика настроена и
+пользователь недавно ничего не записывал: после успешного изменяющего
+запроса ReplicaPinMiddleware на REPLICA_PIN_SECONDS закрепляет его чтения
+за основной базой, чтобы он видел свои записи, пока реплика догоняет.
+Проверка токена и все записи всегда идут в основную базу.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+read_database = ContextVar('read_database', default=None)
+
+
+def replica_configured():
+    return settings.REPLICA_READS and settings.REPLICA_DATABASE in connections.settings
+
+
+def pin_key(user_pk):
+    return f'replica_pin:{user_pk}'
+
+
+def pin(user_pk):
+    caches[settings.REPLICA_PIN_CACHE_ALIAS].set(pin_key(user_pk), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_pk):
+    return caches[settings.REPLICA_PIN_CACHE_ALIAS].get(pin_key(user_pk), False)
+
+
+def database_for(user):
+    """Откуда читать пользователю: реплика или None для основной базы"""
+    if not replica_configured() or not user.is_authenticated or is_pinned(user.pk):
+        return None
+    return settings.REPLICA_DATABASE
+
+
+@contextmanager
+def reading(database):
+    """Запросы на чтение внутри блока идут в database (None - основная база)"""
+    token = read_database.set(database)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Направляет чтения в базу, выбранную для текущего запроса, остальное -
+    в основную. Без реплики или вне ReplicaReadMixin ничего не меняет.
+    """
+
+    def db_for_read(self, model, **hints):
+        # Внутри транзакции основной базы читаем ее же: реплика не видит
+        # ее незакоммиченных записей
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные методы представления DRF читают с реплики. База выбирается
+    после аутентификации, чтобы токен всегда проверялся по основной базе.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self.read_database_token = read_database.set(database_for(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'read_database_token', None)
+        if token is not None:
+            read_database.reset(token)
+            self.read_database_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """Закрепляет чтения пользователя за основной базой после его записи"""
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+            and replica_configured()
+        ):
+            pin(user.pk)
+        return response
@@ -0,0 +1,88 @@
+import hashlib
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    alias = settings.STATISTICS_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def version_key(user_pk, day):
+    return f'stats_version:{user_pk}:{day.isoformat()}'
+
+
+def generation_key(user_pk):
+    return f'stats_generation:{user_pk}'
+
+
+def response_key(user_pk, start_date, end_date, options):
+    return f'stats_range:{user_pk}:{start_date.isoformat()}:{end_date.isoformat()}:{options}'
+
+
+def bump_versions(user_pk, dates):
+    """
+    Меняет версии дат пользователя, делая недействительными кэшированные
+    ответы за периоды, в которые эти даты попадают.
+    """
+    cache = get_cache()
+    if cache is None or not dates:
+        return
+    cache.set_many({version_key(user_pk, day): uuid.uuid4().hex for day in dates}, None)
+
+
+def bump_generation(user_pk):
+    """
+    Делает недействительными все кэшированные ответы пользователя, когда
+    изменились данные за неизвестный набор дат, например после пересчета
+    сводной статистики.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    cache.set(generation_key(user_pk), uuid.uuid4().hex, None)
+
+
+def is_cacheable(start_date, end_date):
+    return get_cache() is not None and (end_date - start_date).days < settings.STATISTICS_CACHE_MAX_DAYS
+
+
+def lookup(user_pk, start_date, end_date, options):
+    """
+    Читает ответ, поколение пользователя и версии всех дат периода одним
+    обращением к кэшу.
+    Возвращает закэшированные данные (или None) и ETag текущих версий.
+    Даты без версии получают новую, так что ответ, сохраненный до
+    вытеснения версии из кэша, больше не подойдет.
+    """
+    cache = get_cache()
+    key = response_key(user_pk, start_date, end_date, options)
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    version_keys = [generation_key(user_pk)] + [version_key(user_pk, day) for day in days]
+
+    found = cache.get_many([key] + version_keys)
+    missing = [name for name in version_keys if name not in found]
+    for name in missing:
+        cache.add(name, uuid.uuid4().hex, None)
+    if missing:
+        found.update(cache.get_many(missing))
+
+    digest = hashlib.sha1(key.encode())
+    for name in version_keys:
+        digest.update(str(found.get(name)).encode())
+    etag = f'"{digest.hexdigest()}"'
+
+    entry = found.get(key)
+    if entry is not None and entry['etag'] == etag:
+        return entry['data'], etag
+    return None, etag
+
+
+def store(user_pk, start_date, end_date, options, etag, data):
+    get_cache().set(
+        response_key(user_pk, start_date, end_date, options),
+        {'etag': etag, 'data': data},
+        settings.STATISTICS_CACHE_TTL,
+    )
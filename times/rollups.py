@@ -0,0 +1,102 @@
+from calendar import monthrange
+from datetime import timedelta
+from django.db.models import Q
+from .models import Statistics, StatisticsRollup
+
+
+def period_start(period, date):
+    if period == StatisticsRollup.WEEK:
+        return date - timedelta(days=date.weekday())
+    return date.replace(day=1)
+
+
+def period_end(period, date):
+    if period == StatisticsRollup.WEEK:
+        return period_start(period, date) + timedelta(days=6)
+    return date.replace(day=monthrange(date.year, date.month)[1])
+
+
+def next_period(period, date):
+    return period_end(period, date) + timedelta(days=1)
+
+
+def split_range(start_date, end_date):
+    """
+    Разбивает период на самые крупные уровни, целиком в него входящие:
+    месяцы, затем недели, затем оставшиеся дни.
+    Возвращает начала месяцев, начала недель и список диапазонов дней.
+    """
+    months = []
+    weeks = []
+    days = []
+
+    def split(period, start, end):
+        covered = []
+        current = start if period_start(period, start) == start else next_period(period, start)
+        while current <= end and period_end(period, current) <= end:
+            covered.append(current)
+            current = next_period(period, current)
+
+        if not covered:
+            return covered, [(start, end)]
+
+        rest = []
+        if start < covered[0]:
+            rest.append((start, covered[0] - timedelta(days=1)))
+        if current <= end:
+            rest.append((current, end))
+        return covered, rest
+
+    months, rest = split(StatisticsRollup.MONTH, start_date, end_date)
+    for start, end in rest:
+        covered, day_ranges = split(StatisticsRollup.WEEK, start, end)
+        weeks += covered
+        days += day_ranges
+
+    return months, weeks, days
+
+
+def collect_rollups(stats_updates):
+    rollups = {}
+
+    for (url, date), data in stats_updates.items():
+        for period in (StatisticsRollup.WEEK, StatisticsRollup.MONTH):
+            key = (url, period, period_start(period, date))
+            if key not in rollups:
+                rollups[key] = {
+                    'session_count': 0,
+                    'time_count': 0,
+                    'favicon_url': None,
+                }
+
+            rollups[key]['session_count'] += data['session_count']
+            rollups[key]['time_count'] += data['time_count']
+            rollups[key]['favicon_url'] = rollups[key]['favicon_url'] or data['favicon_url']
+
+    return rollups
+
+
+def tiered_querysets(user_pk, start_date, end_date):
+    """
+    Дневная статистика и сводные записи, вместе точно покрывающие период.
+    """
+    months, weeks, day_ranges = split_range(start_date, end_date)
+
+    statistics = Statistics.objects.none()
+    if day_ranges:
+        days_q = Q()
+        for start, end in day_ranges:
+            days_q |= Q(period_date__gte=start, period_date__lte=end)
+        statistics = Statistics.objects.filter(days_q, user__pk=user_pk)
+
+    rollups_q = Q()
+    if months:
+        rollups_q |= Q(period=StatisticsRollup.MONTH, period_date__in=months)
+    if weeks:
+        rollups_q |= Q(period=StatisticsRollup.WEEK, period_date__in=weeks)
+
+    rollups = StatisticsRollup.objects.none()
+    if rollups_q:
+        rollups = StatisticsRollup.objects.filter(rollups_q, user__pk=user_pk)
+
+    return statistics, rollups
@@ -4,7 +4,7 @@ from .models import TimeInterval, Statistics
 class TimeIntervalSerializer(serializers.ModelSerializer):
     class Meta:
         model = TimeInterval
-        fields = '__all__'
+        exclude = ['fingerprint']
         extra_kwargs = {
             'url': {'required': True},
             'date': {'required': True},
@@ -18,7 +18,9 @@ class TimeIntervalSerializer(serializers.ModelSerializer):
                 "Время окончания должно быть позже времени начала"
             )
         
+        user = data.get('user') or self.context['request'].user
         if TimeInterval.objects.filter(
+            user=user,
             date=data['date'],
             start_time__lt=data['end_time'],
             end_time__gt=data['start_time']
@@ -37,6 +39,35 @@ class StatisticsSerializer(serializers.ModelSerializer):
     faviconUrl = serializers.CharField(source='favicon_url')
     intervals = TimeIntervalSerializer(many=True)
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_model_fields(cls, fields):
+        declared = cls().fields
+        return [declared[name].source for name in fields if name != 'intervals']
+
     class Meta:
         model = Statistics
-        fields = ['url', 'faviconUrl', 'sessionCount', 'timeCount', 'periodDate', 'intervals']
\ No newline at end of file
+        fields = ['url', 'faviconUrl', 'sessionCount', 'timeCount', 'periodDate', 'intervals']
+
+
+class StatisticsSummarySerializer(serializers.Serializer):
+    url = serializers.CharField(required=False)
+    faviconUrl = serializers.CharField(source='favicon_url', required=False)
+    periodDate = serializers.DateField(source='period', required=False)
+    sessionCount = serializers.IntegerField(source='session_count')
+    timeCount = serializers.IntegerField(source='time_count')
+
+
+
+class StatisticsRollupSerializer(serializers.Serializer):
+    url = serializers.CharField()
+    faviconUrl = serializers.CharField(source='favicon_url')
+    sessionCount = serializers.IntegerField(source='session_count')
+    timeCount = serializers.IntegerField(source='time_count')
+    periodDate = serializers.DateField(source='period_date')
+    period = serializers.CharField()
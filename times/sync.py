@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+# Изменения отдаются не дальше начала самой старой открытой транзакции
+# приложения: ее строки получают время изменения до фиксации и станут видны
+# позже. Транзакция старше SYNC_MAX_TRANSACTION_AGE считается зависшей и
+# синхронизацию не держит; строки, которые она все же зафиксирует, клиенты
+# с более новым токеном пропустят до их следующего изменения.
+# SYNC_LAG - запас на расхождение часов приложения и базы и на время между
+# вычислением updated_at и началом запроса вне транзакции
+SYNC_LAG = timedelta(seconds=10)
+SYNC_MAX_TRANSACTION_AGE = timedelta(minutes=5)
+SYNC_PAGE_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_token(moment):
+    return str((moment - EPOCH) // timedelta(microseconds=1))
+
+
+def decode_token(token):
+    """Токен - время последнего отданного изменения в микросекундах от эпохи"""
+    if not token:
+        return EPOCH
+
+    try:
+        return EPOCH + timedelta(microseconds=int(token))
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError({'since': "Некорректный токен синхронизации"})
+
+
+def oldest_transaction_start():
+    """
+    Начало самой старой транзакции других соединений приложения или None.
+    Соединения приложения отличаются по application_name: строки таблиц
+    синхронизации пишет только оно, а долгие транзакции psql, pg_dump или
+    аналитики на токен не влияют
+    """
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        # Снимок pg_stat_activity иначе держится до конца текущей транзакции
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute(
+            """
+            SELECT min(xact_start) FROM pg_stat_activity
+            WHERE datname = current_database()
+              AND pid <> pg_backend_pid()
+              AND backend_type = 'client backend'
+              AND application_name = current_setting('application_name')
+            """
+        )
+        return cursor.fetchone()[0]
+
+
+def changed_rows(queryset, since, until, limit):
+    """
+    Строки, измененные в (since, until], по возрастанию времени изменения.
+    Если строк больше limit, страница обрезается по границе времени, чтобы
+    строки с одинаковым временем не разделялись между страницами.
+    Возвращает строки и время, до которого изменения отданы полностью.
+    """
+    rows = list(
+        queryset.filter(updated_at__gt=since, updated_at__lte=until).order_by('updated_at', 'id')[:limit + 1]
+    )
+    if len(rows) <= limit:
+        return rows, until
+
+    boundary = rows[limit].updated_at
+    rows = [row for row in rows if row.updated_at < boundary]
+    if not rows:
+        rows = list(queryset.filter(updated_at=boundary).order_by('id'))
+        return rows, boundary
+    return rows, rows[-1].updated_at
+
+
+def collect_changes(querysets, token, limit=None):
+    """
+    Изменения по нескольким таблицам с общего токена. Следующий токен -
+    наименьшее из времен, до которых отдана каждая таблица, поэтому
+    часть строк может прийти повторно и просто перезапишет прежние.
+    """
+    limit = limit or SYNC_PAGE_SIZE
+    since = decode_token(token)
+    now = timezone.now()
+    oldest = oldest_transaction_start()
+    if oldest is not None:
+        now = min(now, max(oldest, now - SYNC_MAX_TRANSACTION_AGE))
+    until = max(now - SYNC_LAG, since)
+
+    changes = {}
+    reached = until
+    for name, queryset in querysets.items():
+        changes[name], table_reached = changed_rows(queryset, since, until, limit)
+        reached = min(reached, table_reached)
+
+    return changes, encode_token(reached), reached < until
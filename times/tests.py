@@ -1,8 +1,33 @@
-from django.test import TestCase
+import copy
+import gzip
+import os
+import random
+import re
+import tempfile
+import threading
+from io import StringIO
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from datetime import date, timedelta
+from unittest import skipUnless
+from django.conf import settings
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from users.models import CustomUser
 import json
 from rest_framework.authtoken.models import Token
-from .models import TimeInterval, Statistics
+from .validators import BrowserURLValidator
+from .replicas import ReplicaRouter, database_for, reading
+from .perf import RequestMetrics, registry
+from .async_views import create_intervals_async, StatisticsRangeAsyncView
+from .parsers import CompactIntervalsParser
+from .ingest import ingest_intervals
+from .deltas import apply_to_statistics, compact_deltas, pending_deltas, statistics_snapshot
+from .models import TimeInterval, Statistics, StatisticsRollup, StatisticsDelta, IntervalBatch
 
 class CreateIntervalsTestCase(TestCase):
     def setUp(self):
@@ -113,7 +138,7 @@ class CreateIntervalsTestCase(TestCase):
         
         stat = Statistics.objects.first()
         self.assertEqual(stat.session_count, 2)
-        self.assertEqual(stat.time_count, 400)  
+        self.assertEqual(stat.time_count, 300)
 
     def test_multiple_intervals(self):
         """Обработка нескольких интервалов за раз"""
@@ -147,3 +172,1584 @@ class CreateIntervalsTestCase(TestCase):
             stat.favicon_url,
             'https://example.com/favicon.ico'
         )
+
+    def test_duplicates_in_batch(self):
+        """Повторы внутри одного пакета и уже сохраненные интервалы"""
+        self.send_request(self.valid_data)
+        data = {'intervals': self.valid_data['intervals'] * 3}
+        response = self.send_request(data)
+
+        self.assertEqual(response.json()['processed'], 3)
+        self.assertEqual(response.json()['duplicates'], 3)
+        self.assertEqual(TimeInterval.objects.count(), 1)
+        self.assertEqual(Statistics.objects.get().session_count, 1)
+
+    def test_same_host_in_batch(self):
+        """Разные страницы одного сайта попадают в одну запись статистики"""
+        data = {
+            'intervals': [
+                {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://example.com/a'},
+                {'startTime': 300, 'endTime': 600, 'date': '2025-01-01', 'url': 'https://example.com/b'},
+            ]
+        }
+        self.send_request(data)
+
+        stat = Statistics.objects.get()
+        self.assertEqual(stat.session_count, 2)
+        self.assertEqual(stat.time_count, 400)
+
+    def test_constant_query_count(self):
+        """Число запросов не зависит от размера пакета"""
+        def batch(size, hosts, offset):
+            return {
+                'intervals': [
+                    {
+                        'startTime': offset + i * 10 + 1,
+                        'endTime': offset + i * 10 + 5,
+                        'date': f'2025-01-{i % 28 + 1:02d}',
+                        'url': f'https://site{i % hosts}.com/page',
+                        'faviconUrl': f'https://site{i % hosts}.com/favicon.ico',
+                    }
+                    for i in range(size)
+                ]
+            }
+
+        # Первый запрос проверяет токен по базе, дальше он берется из кэша
+        self.send_request({'intervals': []})
+        with CaptureQueriesContext(connection) as small:
+            self.send_request(batch(1, 1, 0))
+        with CaptureQueriesContext(connection) as large:
+            response = self.send_request(batch(300, 40, 10000))
+
+        self.assertEqual(response.json()['processed'], 300)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(TimeInterval.objects.count(), 301)
+
+    def test_fingerprint(self):
+        """Отпечаток интервала вычисляется при сохранении"""
+        self.send_request(self.valid_data)
+        interval = TimeInterval.objects.get()
+        self.assertEqual(interval.fingerprint, interval.get_fingerprint())
+
+        TimeInterval.objects.update(fingerprint=None)
+        call_command('backfill_fingerprints', stdout=StringIO())
+        call_command('verify_fingerprints', stdout=StringIO())
+        self.assertEqual(TimeInterval.objects.get().fingerprint, interval.fingerprint)
+
+    def test_backfill_duplicates(self):
+        """Точные повторы не мешают заполнению отпечатков"""
+        self.send_request(self.valid_data)
+        old = TimeInterval(url='https://example.com', start_time=100, end_time=200, date=date(2025, 1, 1), user=self.user)
+        TimeInterval.objects.bulk_create([old, copy.copy(old), copy.copy(old)])
+
+        out = StringIO()
+        call_command('backfill_fingerprints', stdout=out)
+        self.assertIn('Повторы без отпечатка (3)', out.getvalue())
+        self.assertEqual(TimeInterval.objects.filter(fingerprint__isnull=True).count(), 3)
+
+        call_command('backfill_fingerprints', delete_duplicates=True, stdout=StringIO())
+        self.assertEqual(TimeInterval.objects.count(), 1)
+
+    def test_hostname(self):
+        """Хост интервала совпадает с url статистики"""
+        self.send_request(self.valid_data)
+        stat = Statistics.objects.get()
+        self.assertEqual(TimeInterval.objects.get().hostname, stat.url)
+        self.assertEqual(stat.intervals.count(), 1)
+
+        TimeInterval.objects.update(hostname=None)
+        call_command('backfill_hostnames', chunk_size=1, stdout=StringIO())
+        self.assertEqual(TimeInterval.objects.get().hostname, 'example.com')
+
+
+    def test_long_hostname(self):
+        """Хост длиннее поля отклоняется как ошибка валидации"""
+        host = '.'.join(['a' * 60] * 5) + '.com'
+        response = self.send_request({'intervals': [{**self.valid_data['intervals'][0], 'url': f'https://{host}/'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TimeInterval.objects.exists())
+
+    def test_async_mode(self):
+        """Асинхронный режим: пакет ставится в очередь и обрабатывается командой"""
+        response = self.client.post(
+            self.url + '?mode=async',
+            data=json.dumps(self.valid_data),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(TimeInterval.objects.count(), 0)
+
+        self.client.post(
+            self.url + '?mode=async',
+            data=json.dumps(self.valid_data),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        call_command('process_interval_batches', stdout=StringIO())
+
+        self.assertEqual(TimeInterval.objects.count(), 1)
+        self.assertEqual(Statistics.objects.get().session_count, 1)
+        batches = IntervalBatch.objects.order_by('pk')
+        self.assertEqual([(batch.processed, batch.duplicates) for batch in batches], [(1, 0), (1, 1)])
+        self.assertFalse(batches.filter(processed_at__isnull=True).exists())
+
+        call_command('process_interval_batches', stdout=StringIO())
+        self.assertEqual(Statistics.objects.get().session_count, 1)
+
+    def test_async_mode_validation(self):
+        """Асинхронный режим проверяет данные до постановки в очередь"""
+        invalid_data = {'intervals': [{'url': 'https://example.com'}]}
+        response = self.client.post(
+            self.url + '?mode=async',
+            data=json.dumps(invalid_data),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IntervalBatch.objects.exists())
+
+    @skipUnless(connection.vendor == 'postgresql', "Переполнение integer проверяется только в PostgreSQL")
+    def test_async_mode_database_error(self):
+        """Ошибка базы в пакете одного пользователя не останавливает очередь"""
+        other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+        # Сумма времени не помещается в поле статистики
+        IntervalBatch.objects.create(user=self.user, payload=[
+            {'startTime': 1, 'endTime': 2000000000, 'date': '2025-01-01', 'url': 'https://example.com'},
+            {'startTime': 2, 'endTime': 2000000000, 'date': '2025-01-01', 'url': 'https://example.com'},
+        ])
+        IntervalBatch.objects.create(user=other, payload=self.valid_data['intervals'])
+
+        call_command('process_interval_batches', stdout=StringIO())
+
+        failed, processed = IntervalBatch.objects.order_by('pk')
+        self.assertTrue(failed.error)
+        self.assertIsNotNone(failed.processed_at)
+        self.assertEqual((processed.processed, processed.duplicates, processed.error), (1, 0, ''))
+        self.assertEqual(list(TimeInterval.objects.values_list('user', flat=True)), [other.pk])
+
+@skipUnless(connection.vendor == 'postgresql', "Ожидание на уникальном индексе проверяется только в PostgreSQL")
+class ConcurrentIngestTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='testuser@test.test', password='testpass')
+        self.items = [
+            {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://example.com/a'},
+            {'startTime': 300, 'endTime': 400, 'date': '2025-01-01', 'url': 'https://example.com/b'},
+        ]
+
+    def test_concurrent_retry(self):
+        """Повтор пакета, пока первый еще не зафиксирован, не удваивает статистику"""
+        results = []
+
+        def retry():
+            try:
+                results.append(ingest_intervals(self.items, self.user))
+            finally:
+                connections.close_all()
+
+        with transaction.atomic():
+            self.assertEqual(ingest_intervals(self.items, self.user), (2, 0))
+            thread = threading.Thread(target=retry)
+            thread.start()
+            # Повтор ждет на уникальном индексе до фиксации первого пакета
+            thread.join(0.5)
+        thread.join()
+
+        self.assertEqual(results, [(2, 2)])
+        self.assertEqual(TimeInterval.objects.count(), 2)
+        stat = Statistics.objects.get()
+        self.assertEqual(stat.session_count, 2)
+        self.assertEqual(stat.time_count, 200)
+
+
+class StatisticsRangeTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.url = '/api/statistics/'
+
+    def create_intervals(self, days, hosts):
+        intervals = [
+            {
+                'startTime': 100 + host * 1000,
+                'endTime': 200 + host * 1000,
+                'date': f'2025-01-{day:02d}',
+                'url': f'https://site{host}.com/page',
+                'faviconUrl': f'https://site{host}.com/favicon.ico',
+            }
+            for day in range(1, days + 1)
+            for host in range(hosts)
+        ]
+        self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': intervals}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def send_request(self, params):
+        return self.client.get(
+            self.url,
+            params,
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def test_intervals_attached(self):
+        """Интервалы привязываются к своей записи статистики"""
+        self.create_intervals(days=2, hosts=2)
+        response = self.send_request({'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+        for row in response.json():
+            self.assertEqual(len(row['intervals']), 1)
+            self.assertEqual(row['intervals'][0]['hostname'], row['url'])
+            self.assertEqual(row['intervals'][0]['date'], row['periodDate'])
+
+    def test_constant_query_count(self):
+        """Число запросов не зависит от количества строк статистики"""
+        self.create_intervals(days=30, hosts=10)
+
+        # Токен уже проверен при загрузке интервалов: статистика, интервалы
+        with self.assertNumQueries(2):
+            response = self.send_request({'period_date_start': '2025-01-01', 'period_date_end': '2025-01-30'})
+        self.assertEqual(len(response.json()), 300)
+
+        with self.assertNumQueries(2):
+            self.send_request({'period_date_start': '2025-01-01', 'period_date_end': '2025-01-01'})
+
+    def test_fields_projection(self):
+        """Без include=intervals таблица интервалов не запрашивается"""
+        self.create_intervals(days=2, hosts=2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send_request({
+                'period_date_start': '2025-01-01',
+                'period_date_end': '2025-01-02',
+                'fields': 'url,timeCount',
+            })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()[0]), {'url', 'timeCount'})
+        self.assertFalse(any('times_timeinterval' in query['sql'] for query in queries))
+
+    def test_include_intervals(self):
+        """Интервалы добавляются по include=intervals"""
+        self.create_intervals(days=1, hosts=1)
+        response = self.send_request({
+            'period_date_start': '2025-01-01',
+            'period_date_end': '2025-01-01',
+            'fields': 'url',
+            'include': 'intervals',
+        })
+
+        self.assertEqual(set(response.json()[0]), {'url', 'intervals'})
+        self.assertEqual(len(response.json()[0]['intervals']), 1)
+
+    def test_unknown_field(self):
+        """Неизвестное поле в fields"""
+        response = self.send_request({
+            'period_date_start': '2025-01-01',
+            'period_date_end': '2025-01-01',
+            'fields': 'url,password',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_by_url(self):
+        """Суммы по сайтам считаются в базе"""
+        self.create_intervals(days=3, hosts=3)
+        response = self.client.get(
+            '/api/statistics/summary/',
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-03', 'limit': 2},
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(response.json()[0]['sessionCount'], 3)
+        self.assertEqual(response.json()[0]['timeCount'], 300)
+
+    def test_summary_by_month(self):
+        """Суммы по месяцам"""
+        self.create_intervals(days=3, hosts=2)
+        response = self.client.get(
+            '/api/statistics/summary/',
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-31', 'group_by': 'month'},
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+        self.assertEqual(response.json(), [
+            {'periodDate': '2025-01-01', 'sessionCount': 6, 'timeCount': 600},
+        ])
+
+    def test_rollups_maintained(self):
+        """Недельная и месячная статистика обновляется вместе с дневной"""
+        self.create_intervals(days=31, hosts=2)
+
+        month = StatisticsRollup.objects.get(period=StatisticsRollup.MONTH, url='site0.com')
+        self.assertEqual(month.session_count, 31)
+        self.assertEqual(month.time_count, 3100)
+
+        weeks = StatisticsRollup.objects.filter(period=StatisticsRollup.WEEK, url='site0.com')
+        self.assertEqual(sum(week.session_count for week in weeks), 31)
+
+        before = list(StatisticsRollup.objects.values().order_by('pk'))
+        call_command('rebuild_rollups', stdout=StringIO())
+        after = list(StatisticsRollup.objects.values().order_by('pk'))
+        strip = lambda rows: sorted((row['url'], row['period'], row['period_date'], row['time_count']) for row in rows)
+        self.assertEqual(strip(before), strip(after))
+
+        # Шаг развертывания не трогает сошедшиеся записи
+        call_command('rebuild_rollups', stale=True, stdout=StringIO())
+        self.assertEqual(list(StatisticsRollup.objects.values().order_by('pk')), after)
+        StatisticsRollup.objects.all().delete()
+        call_command('rebuild_rollups', stale=True, stdout=StringIO())
+        self.assertEqual(strip(StatisticsRollup.objects.values()), strip(after))
+
+    def test_stale_rollups_repaired(self):
+        """Дневная статистика без сводных записей (воркер старой версии) пересчитывается"""
+        self.create_intervals(days=3, hosts=1)
+        other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+        Statistics.objects.create(
+            user=other, url='site0.com', period_date=date(2025, 1, 1), session_count=1, time_count=100
+        )
+
+        # Строка старого кода у пользователя, у которого сводные записи уже есть
+        Statistics.objects.create(
+            user=self.user, url='site9.com', period_date=date(2025, 1, 2), session_count=1, time_count=50
+        )
+        call_command('rebuild_rollups', stale=True, stdout=StringIO())
+
+        month = StatisticsRollup.objects.get(user=other, period=StatisticsRollup.MONTH)
+        self.assertEqual((month.url, month.time_count), ('site0.com', 100))
+        self.assertEqual(
+            StatisticsRollup.objects.get(user=self.user, period=StatisticsRollup.MONTH, url='site9.com').time_count,
+            50,
+        )
+
+        rebuilt = list(StatisticsRollup.objects.values().order_by('pk'))
+        call_command('rebuild_rollups', stale=True, stdout=StringIO())
+        self.assertEqual(list(StatisticsRollup.objects.values().order_by('pk')), rebuilt)
+
+    def test_auto_granularity(self):
+        """Строки берутся из самых крупных уровней, покрывающих период"""
+        self.create_intervals(days=31, hosts=1)
+        response = self.send_request({
+            'period_date_start': '2025-01-01',
+            'period_date_end': '2025-01-31',
+            'granularity': 'auto',
+        })
+        self.assertEqual(response.json(), [{
+            'url': 'site0.com',
+            'faviconUrl': 'https://site0.com/favicon.ico',
+            'sessionCount': 31,
+            'timeCount': 3100,
+            'periodDate': '2025-01-01',
+            'period': 'month',
+        }])
+
+        response = self.send_request({
+            'period_date_start': '2025-01-05',
+            'period_date_end': '2025-01-19',
+            'granularity': 'auto',
+        })
+        periods = sorted((row['period'], row['periodDate']) for row in response.json())
+        self.assertEqual(periods, [('day', '2025-01-05'), ('week', '2025-01-06'), ('week', '2025-01-13')])
+        self.assertEqual(sum(row['sessionCount'] for row in response.json()), 15)
+
+    def test_auto_granularity_projection(self):
+        """fields и include при granularity=auto отклоняются"""
+        self.create_intervals(days=1, hosts=1)
+        period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-31', 'granularity': 'auto'}
+        for params in ({'fields': 'url'}, {'include': 'intervals'}, {'fields': 'url', 'include': 'intervals'}):
+            self.assertEqual(self.send_request({**period, **params}).status_code, 400)
+
+
+class IntervalListTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+
+        intervals = []
+        for user in (self.user, other):
+            for day in range(1, 6):
+                for start in (300, 100, 200, 100):
+                    intervals.append(TimeInterval(
+                        url=f'https://site{len(intervals)}.com/',
+                        start_time=start,
+                        end_time=start + 50,
+                        date=date(2025, 1, day),
+                        user=user,
+                    ))
+        for interval in intervals:
+            interval.save()
+
+    def get(self, url, params=None):
+        return self.client.get(url, params, HTTP_AUTHORIZATION=f'Token {self.token.key}').json()
+
+    def test_page_number(self):
+        """Обычная постраничная навигация только по своим интервалам"""
+        response = self.get('/api/intervals/')
+        self.assertEqual(response['count'], 20)
+        self.assertEqual(len(response['results']), 20)
+
+    def test_cursor_walk(self):
+        """Обход всей истории курсором в порядке (-date, start_time, id)"""
+        expected = list(
+            TimeInterval.objects.filter(user=self.user)
+            .order_by('-date', 'start_time', 'id')
+            .values_list('id', flat=True)
+        )
+
+        seen = []
+        response = self.get('/api/intervals/', {'pagination': 'cursor', 'page_size': 3})
+        self.assertNotIn('count', response)
+        while True:
+            self.assertLessEqual(len(response['results']), 3)
+            seen += [row['id'] for row in response['results']]
+            if not response['next']:
+                break
+            with self.assertNumQueries(1):
+                response = self.get(response['next'])
+
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        """Некорректный курсор"""
+        response = self.client.get(
+            '/api/intervals/', {'cursor': 'broken'}, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+class ImportIntervalsTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.url = '/api/import_intervals/'
+
+    def send_request(self, lines):
+        return self.client.post(
+            self.url,
+            data='\n'.join(lines),
+            content_type='application/x-ndjson',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def make_lines(self, count):
+        return [
+            json.dumps({
+                'startTime': i * 100 + 1,
+                'endTime': i * 100 + 50,
+                'date': '2025-01-01',
+                'url': 'https://example.com',
+            })
+            for i in range(count)
+        ]
+
+    @patch('times.views.IMPORT_CHUNK_SIZE', 2)
+    def test_chunked_import(self):
+        """Интервалы сохраняются порциями"""
+        lines = self.make_lines(5)
+        response = self.send_request(lines + lines[:1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processed'], 6)
+        self.assertEqual(response.json()['duplicates'], 1)
+        self.assertEqual(response.json()['chunks'], [
+            {'processed': 2, 'duplicates': 0},
+            {'processed': 2, 'duplicates': 0},
+            {'processed': 2, 'duplicates': 1},
+        ])
+        self.assertEqual(TimeInterval.objects.count(), 5)
+        self.assertEqual(Statistics.objects.get().session_count, 5)
+
+    @patch('times.views.IMPORT_CHUNK_SIZE', 2)
+    def test_invalid_line(self):
+        """Ошибка в строке не отменяет уже сохраненные порции"""
+        response = self.send_request(self.make_lines(2) + ['invalid json'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 3', response.json()['error'])
+        self.assertEqual(response.json()['chunks'], [{'processed': 2, 'duplicates': 0}])
+        self.assertEqual(TimeInterval.objects.count(), 2)
+
+
+class CompactFormatTestCase(TestCase):
+    def setUp(self):
+        self.users = []
+        for email in ('json@test.test', 'compact@test.test'):
+            user = CustomUser.objects.create_user(email=email, password='testpass')
+            self.users.append((user, Token.objects.create(user=user)))
+        self.url = '/api/create_intervals/'
+
+        self.intervals = [
+            {
+                'startTime': 1000 + i * 300,
+                'endTime': 1000 + i * 300 + 100 + i,
+                'date': f'2025-01-0{i % 3 + 1}',
+                'url': f'https://site{i % 4}.com/page{i % 2}',
+                'faviconUrl': f'https://site{i % 4}.com/favicon.ico' if i % 5 else None,
+            }
+            for i in range(40)
+        ]
+
+    def encode_compact(self, intervals):
+        urls, favicons, dates = [], [], []
+        columns = {'url': [], 'favicon': [], 'date': [], 'start': [], 'duration': []}
+        previous_start = 0
+        for item in intervals:
+            for values, value, column in ((urls, item['url'], 'url'), (dates, item['date'], 'date')):
+                if value not in values:
+                    values.append(value)
+                columns[column].append(values.index(value))
+            if item['faviconUrl'] is None:
+                columns['favicon'].append(None)
+            else:
+                if item['faviconUrl'] not in favicons:
+                    favicons.append(item['faviconUrl'])
+                columns['favicon'].append(favicons.index(item['faviconUrl']))
+            columns['start'].append(item['startTime'] - previous_start)
+            columns['duration'].append(item['endTime'] - item['startTime'])
+            previous_start = item['startTime']
+        return {'urls': urls, 'favicons': favicons, 'dates': dates, **columns}
+
+    def send_request(self, token, body, content_type, **extra):
+        return self.client.post(
+            self.url,
+            data=body,
+            content_type=content_type,
+            HTTP_AUTHORIZATION=f'Token {token.key}',
+            **extra
+        )
+
+    def rows(self, user):
+        intervals = TimeInterval.objects.filter(user=user).values_list(
+            'url', 'favicon_url', 'date', 'start_time', 'end_time', 'hostname'
+        ).order_by('date', 'start_time')
+        statistics = Statistics.objects.filter(user=user).values_list(
+            'url', 'favicon_url', 'period_date', 'session_count', 'time_count'
+        ).order_by('period_date', 'url')
+        return list(intervals), list(statistics)
+
+    def test_compact_gzip_parity(self):
+        """Сжатый колоночный формат дает те же записи, что и JSON"""
+        (json_user, json_token), (compact_user, compact_token) = self.users
+
+        response = self.send_request(json_token, json.dumps({'intervals': self.intervals}), 'application/json')
+        self.assertEqual(response.status_code, 200)
+
+        body = gzip.compress(json.dumps(self.encode_compact(self.intervals)).encode())
+        response = self.send_request(
+            compact_token, body, 'application/vnd.webtime.intervals+json', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processed'], 40)
+        self.assertEqual(self.rows(json_user), self.rows(compact_user))
+
+    def test_gzip_json(self):
+        """Сжатый gzip обычный JSON"""
+        user, token = self.users[0]
+        body = gzip.compress(json.dumps({'intervals': self.intervals}).encode())
+        response = self.send_request(token, body, 'application/json', HTTP_CONTENT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TimeInterval.objects.filter(user=user).count(), 40)
+
+    @override_settings(MAX_DECOMPRESSED_BODY_SIZE=1000)
+    def test_decompressed_size_limit(self):
+        """Слишком большое после распаковки тело отклоняется по размеру, а не как JSON"""
+        user, token = self.users[0]
+        body = gzip.compress(json.dumps({'intervals': self.intervals}).encode())
+        response = self.send_request(token, body, 'application/json', HTTP_CONTENT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertNotIn('JSON', response.json()['error'])
+        self.assertEqual(TimeInterval.objects.count(), 0)
+
+    def test_invalid_compact(self):
+        """Некорректный колоночный формат"""
+        user, token = self.users[0]
+        data = self.encode_compact(self.intervals)
+        data['url'] = data['url'][:-1]
+        response = self.send_request(token, json.dumps(data), 'application/vnd.webtime.intervals+json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(TimeInterval.objects.count(), 0)
+
+
+@override_settings(STATISTICS_DELTAS=True)
+class StatisticsDeltasTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def send_intervals(self, intervals):
+        return self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': intervals}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def get(self, url, params):
+        return self.client.get(url, params, HTTP_AUTHORIZATION=f'Token {self.token.key}').json()
+
+    def make_interval(self, start, date='2025-01-01', host='example.com'):
+        return {
+            'startTime': start,
+            'endTime': start + 100,
+            'date': date,
+            'url': f'https://{host}/',
+            'faviconUrl': f'https://{host}/favicon.ico',
+        }
+
+    def test_reads_include_pending(self):
+        """Чтение учитывает свернутые и несвернутые приращения"""
+        self.send_intervals([self.make_interval(100), self.make_interval(300)])
+        self.assertFalse(Statistics.objects.exists())
+        self.assertEqual(StatisticsDelta.objects.count(), 1)
+
+        call_command('compact_statistics', stdout=StringIO())
+        self.assertFalse(StatisticsDelta.objects.exists())
+        self.assertEqual(Statistics.objects.get().session_count, 2)
+        self.assertEqual(StatisticsRollup.objects.get(period=StatisticsRollup.MONTH).time_count, 200)
+
+        self.send_intervals([self.make_interval(500), self.make_interval(100, date='2025-01-02', host='other.com')])
+        period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-31'}
+
+        rows = self.get('/api/statistics/', {**period, 'fields': 'url,sessionCount,timeCount'})
+        self.assertEqual(rows, [
+            {'url': 'example.com', 'sessionCount': 3, 'timeCount': 300},
+            {'url': 'other.com', 'sessionCount': 1, 'timeCount': 100},
+        ])
+
+        rows = self.get('/api/statistics/', {**period, 'granularity': 'auto'})
+        self.assertEqual([(row['url'], row['period'], row['timeCount']) for row in rows], [
+            ('example.com', 'month', 300),
+            ('other.com', 'month', 100),
+        ])
+
+        rows = self.get('/api/statistics/summary/', period)
+        self.assertEqual([(row['url'], row['timeCount']) for row in rows], [('example.com', 300), ('other.com', 100)])
+
+        rows = self.get('/api/statistics/summary/', {**period, 'group_by': 'day'})
+        self.assertEqual([(row['periodDate'], row['timeCount']) for row in rows], [('2025-01-01', 300), ('2025-01-02', 100)])
+
+        call_command('compact_statistics', stdout=StringIO())
+        self.assertEqual(Statistics.objects.get(url='example.com').time_count, 300)
+
+
+
+@skipUnless(connection.vendor == 'postgresql', "Уровень изоляции проверяется только в PostgreSQL")
+@override_settings(STATISTICS_DELTAS=True)
+class StatisticsSnapshotTestCase(TransactionTestCase):
+    def test_compaction_between_reads(self):
+        """Свертка между чтением статистики и приращений не теряет приращения"""
+        user = CustomUser.objects.create_user(email='testuser@test.test', password='testpass')
+        ingest_intervals([{'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://example.com'}], user)
+        day = date(2025, 1, 1)
+
+        def compact():
+            try:
+                compact_deltas(100)
+            finally:
+                connections.close_all()
+
+        with statistics_snapshot():
+            statistics = list(Statistics.objects.filter(user=user))
+            thread = threading.Thread(target=compact)
+            thread.start()
+            thread.join()
+            pending = pending_deltas(user.pk, day, day)
+
+        self.assertFalse(StatisticsDelta.objects.exists())
+        statistics = apply_to_statistics(statistics, pending, user.pk)
+        self.assertEqual([(stat.session_count, stat.time_count) for stat in statistics], [(1, 100)])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Планы запросов проверяются только в PostgreSQL")
+class IndexUsageTestCase(TestCase):
+    """Горячие запросы приложения могут выполняться по индексам без полного просмотра таблиц"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Таблицы достаточно велики, чтобы планировщик сам предпочел индекс
+        cls.users = [
+            CustomUser.objects.create_user(email=f'user{i}@test.test', password='testpass')
+            for i in range(10)
+        ]
+        intervals = []
+        statistics = []
+        for user in cls.users:
+            for day in range(100):
+                period_date = date(2025, 1, 1) + timedelta(days=day)
+                for host in range(10):
+                    interval = TimeInterval(
+                        url=f'https://site{host}.com/',
+                        hostname=f'site{host}.com',
+                        start_time=host * 1000 + 1,
+                        end_time=host * 1000 + 500,
+                        date=period_date,
+                        user=user,
+                    )
+                    interval.fingerprint = interval.get_fingerprint()
+                    intervals.append(interval)
+                    statistics.append(Statistics(
+                        url=f'site{host}.com',
+                        session_count=1,
+                        time_count=499,
+                        period_date=period_date,
+                        user=user,
+                    ))
+        TimeInterval.objects.bulk_create(intervals, batch_size=5000)
+        Statistics.objects.bulk_create(statistics, batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {TimeInterval._meta.db_table}, {Statistics._meta.db_table}')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertIn(index_name, plan)
+
+    def test_statistics_range(self):
+        user = self.users[1]
+        self.assertUsesIndex(
+            Statistics.objects.filter(
+                user__pk=user.pk,
+                period_date__gte=date(2025, 1, 10),
+                period_date__lte=date(2025, 1, 20),
+            ).order_by('-time_count'),
+            'times_stat_user_period_idx',
+        )
+
+    def test_interval_list(self):
+        self.assertUsesIndex(
+            TimeInterval.objects.filter(user=self.users[1]).order_by('-date', 'start_time')[:20],
+            'times_interval_user_keyset_idx',
+        )
+
+    def test_interval_overlap(self):
+        self.assertUsesIndex(
+            TimeInterval.objects.filter(
+                user=self.users[1],
+                date=date(2025, 1, 5),
+                start_time__lt=2000,
+                end_time__gt=1500,
+            ),
+            'times_interval_user_keyset_idx',
+        )
+
+    def test_intervals_by_hostname(self):
+        self.assertUsesIndex(
+            TimeInterval.objects.filter_by_hostname('site1.com').filter(
+                user=self.users[1],
+                date__gte=date(2025, 1, 10),
+                date__lte=date(2025, 1, 20),
+            ),
+            'times_interval_user_host_idx',
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', "CREATE INDEX CONCURRENTLY поддерживается только в PostgreSQL")
+class CreateIndexesConcurrentlyTestCase(TransactionTestCase):
+    index_name = 'times_interval_user_host_idx'
+
+    def index_state(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = %s::regclass", [self.index_name]
+            )
+            valid = cursor.fetchone()[0]
+            constraints = connection.introspection.get_constraints(cursor, TimeInterval._meta.db_table)
+        return valid, constraints[self.index_name]['columns']
+
+    def test_rebuilds_invalid_index(self):
+        """Индекс, оставшийся INVALID после прерванной постройки, строится заново"""
+        user = CustomUser.objects.create_user(email='testuser@test.test', password='testpass')
+        for start_time in (100, 300):
+            TimeInterval.objects.create(
+                user=user, url='https://example.com', start_time=start_time,
+                end_time=start_time + 100, date=date(2025, 1, 1)
+            )
+
+        # Уникальный индекс по user_id не строится на двух строках одного
+        # пользователя, и PostgreSQL оставляет его под этим именем INVALID
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX {self.index_name}')
+            with self.assertRaises(IntegrityError):
+                cursor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {self.index_name} ON times_timeinterval (user_id)')
+        self.assertEqual(self.index_state(), (False, ['user_id']))
+
+        out = StringIO()
+        call_command('create_indexes_concurrently', stdout=out)
+        self.assertIn('INVALID', out.getvalue())
+        self.assertEqual(self.index_state(), (True, ['user_id', 'hostname', 'date']))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Секционирование поддерживается только в PostgreSQL")
+class PartitioningTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def send_intervals(self, dates):
+        return self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': [
+                {'startTime': 100, 'endTime': 200, 'date': value, 'url': 'https://example.com'}
+                for value in dates
+            ]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        ).json()
+
+    def partition_count(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {name}')
+            return cursor.fetchone()[0]
+
+    def unique_constraints(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, TimeInterval._meta.db_table)
+        return {
+            name: constraint['columns'] for name, constraint in constraints.items()
+            if constraint['unique'] and not constraint['primary_key']
+        }
+
+    def test_convert_and_maintain(self):
+        """Перевод на секционирование сохраняет данные и отсекает лишние партиции"""
+        self.send_intervals(['2025-01-10', '2025-02-10'])
+        declared = {
+            constraint.name: [TimeInterval._meta.get_field(name).column for name in constraint.fields]
+            for constraint in TimeInterval._meta.constraints
+        }
+        self.assertEqual(self.unique_constraints(), declared)
+        call_command('partition_intervals', convert=True, ahead=1, stdout=StringIO())
+        # Ограничения в базе совпадают с моделью и после перевода
+        self.assertEqual(self.unique_constraints(), declared)
+
+        self.assertEqual(TimeInterval.objects.count(), 2)
+        self.assertEqual(self.partition_count('times_timeinterval_p2025_01'), 1)
+
+        response = self.send_intervals(['2025-01-10', '2025-01-11', '1999-01-01'])
+        self.assertEqual(response['duplicates'], 1)
+        self.assertEqual(self.partition_count('times_timeinterval_p2025_01'), 2)
+        self.assertEqual(self.partition_count('times_timeinterval_default'), 1)
+
+        plan = TimeInterval.objects.filter(
+            user=self.user, date__gte=date(2025, 1, 1), date__lte=date(2025, 1, 31)
+        ).explain()
+        self.assertIn('times_timeinterval_p2025_01', plan)
+        self.assertNotIn('times_timeinterval_p2025_02', plan)
+
+        call_command('partition_intervals', detach_before='2025-02-01', stdout=StringIO())
+        self.assertEqual(TimeInterval.objects.filter(date__lt=date(2025, 2, 1)).count(), 1)
+        self.assertEqual(self.partition_count('times_timeinterval_p2025_01'), 2)
+
+
+@patch('times.sync.SYNC_LAG', timedelta(0))
+class SyncTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def send_intervals(self, intervals):
+        return self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': intervals}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def sync(self, since=None):
+        params = {'since': since} if since else {}
+        return self.client.get('/api/sync/', params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_incremental_sync(self):
+        """Повторная синхронизация отдает только измененные строки"""
+        self.send_intervals([
+            {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com'},
+            {'startTime': 300, 'endTime': 400, 'date': '2025-01-01', 'url': 'https://b.com'},
+        ])
+        other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+        TimeInterval(url='https://c.com', start_time=1, end_time=2, date=date(2025, 1, 1), user=other).save()
+
+        response = self.sync().json()
+        self.assertEqual(len(response['intervals']), 2)
+        self.assertEqual(len(response['statistics']), 2)
+        self.assertFalse(response['more'])
+
+        response = self.sync(response['next']).json()
+        self.assertEqual(response['intervals'], [])
+        self.assertEqual(response['statistics'], [])
+
+        self.send_intervals([
+            {'startTime': 500, 'endTime': 600, 'date': '2025-01-01', 'url': 'https://a.com'},
+        ])
+        response = self.sync(response['next']).json()
+        self.assertEqual([interval['start_time'] for interval in response['intervals']], [500])
+        self.assertEqual(len(response['statistics']), 1)
+        self.assertEqual(response['statistics'][0]['url'], 'a.com')
+        self.assertEqual(response['statistics'][0]['timeCount'], 200)
+
+    def test_paged_sync(self):
+        """При ограничении страницы все изменения приходят за несколько запросов"""
+        self.send_intervals([
+            {'startTime': start, 'endTime': start + 10, 'date': '2025-01-01', 'url': f'https://site{start}.com'}
+            for start in range(0, 100, 20)
+        ])
+
+        received = set()
+        token = None
+        with patch('times.sync.SYNC_PAGE_SIZE', 2):
+            for _ in range(10):
+                response = self.sync(token).json()
+                received.update(interval['id'] for interval in response['intervals'])
+                token = response['next']
+                if not response['more']:
+                    break
+
+        self.assertEqual(received, set(TimeInterval.objects.values_list('id', flat=True)))
+        self.assertFalse(response['more'])
+
+    @skipUnless(connection.vendor == 'postgresql', "Открытые транзакции видны только в PostgreSQL")
+    def test_open_transaction(self):
+        """Строки, время которых позже начала чужой открытой транзакции, ждут ее завершения"""
+        self.send_intervals([{'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com'}])
+        started = threading.Event()
+        release = threading.Event()
+
+        def hold_transaction():
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    started.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=hold_transaction)
+        thread.start()
+        try:
+            started.wait(10)
+            self.send_intervals([{'startTime': 300, 'endTime': 400, 'date': '2025-01-01', 'url': 'https://a.com'}])
+            response = self.sync().json()
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual([interval['start_time'] for interval in response['intervals']], [100])
+        response = self.sync(response['next']).json()
+        self.assertEqual([interval['start_time'] for interval in response['intervals']], [300])
+
+    @skipUnless(connection.vendor == 'postgresql', "Открытые транзакции видны только в PostgreSQL")
+    def test_unrelated_transaction(self):
+        """Долгая транзакция чужого клиента базы не задерживает синхронизацию"""
+        params = {**connection.get_connection_params(), 'application_name': 'psql'}
+        other = connection.Database.connect(**params)
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            self.send_intervals([{'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com'}])
+            response = self.sync().json()
+        finally:
+            other.close()
+
+        self.assertEqual([interval['start_time'] for interval in response['intervals']], [100])
+
+    @skipUnless(connection.vendor == 'postgresql', "Открытые транзакции видны только в PostgreSQL")
+    @patch('times.sync.SYNC_MAX_TRANSACTION_AGE', timedelta(0))
+    def test_stuck_transaction(self):
+        """Зависшая транзакция приложения держит синхронизацию не дольше SYNC_MAX_TRANSACTION_AGE"""
+        other = connection.Database.connect(**connection.get_connection_params())
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            self.send_intervals([{'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com'}])
+            response = self.sync().json()
+        finally:
+            other.close()
+
+        self.assertEqual([interval['start_time'] for interval in response['intervals']], [100])
+
+    def test_invalid_token(self):
+        """Некорректный токен синхронизации"""
+        self.assertEqual(self.sync('abc').status_code, 400)
+
+
+@override_settings(STATISTICS_CACHE_ALIAS='default')
+class StatisticsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-10'}
+
+    def send_intervals(self, day, start):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/create_intervals/',
+                data=json.dumps({'intervals': [
+                    {'startTime': start, 'endTime': start + 100, 'date': day, 'url': 'https://example.com'},
+                ]}),
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Token {self.token.key}'
+            )
+
+    def get(self, params, **headers):
+        return self.client.get('/api/statistics/', params, HTTP_AUTHORIZATION=f'Token {self.token.key}', **headers)
+
+    def test_repeat_read_from_cache(self):
+        """Повторное чтение периода не обращается к базе"""
+        self.send_intervals('2025-01-05', 100)
+        first = self.get(self.period)
+        with self.assertNumQueries(0):
+            second = self.get(self.period)
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_not_modified(self):
+        """If-None-Match с текущим ETag возвращает 304"""
+        self.send_intervals('2025-01-05', 100)
+        etag = self.get(self.period)['ETag']
+
+        response = self.get(self.period, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidation_by_date(self):
+        """Загрузка интервалов сбрасывает только периоды, содержащие их дату"""
+        self.send_intervals('2025-01-05', 100)
+        other_period = {'period_date_start': '2025-02-01', 'period_date_end': '2025-02-10'}
+        etag = self.get(self.period)['ETag']
+        other_etag = self.get(other_period)['ETag']
+
+        self.send_intervals('2025-01-07', 500)
+
+        response = self.get(self.period, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get(other_period, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+
+    def test_invalidation_by_rebuild(self):
+        """Пересчет сводной статистики сбрасывает кэш пересчитанных пользователей"""
+        self.send_intervals('2025-01-05', 100)
+        etag = self.get(self.period)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.get(self.period, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(STATISTICS_DELTAS=True)
+    def test_invalidation_by_compaction(self):
+        """Свертка приращений сбрасывает кэш дат свернутых приращений"""
+        self.send_intervals('2025-01-05', 100)
+        other_period = {'period_date_start': '2025-02-01', 'period_date_end': '2025-02-10'}
+        etag = self.get(self.period)['ETag']
+        other_etag = self.get(other_period)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compact_statistics', stdout=StringIO())
+        self.assertEqual(self.get(self.period, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.get(other_period, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+
+    def test_options_in_key(self):
+        """Разные параметры ответа кэшируются отдельно"""
+        self.send_intervals('2025-01-05', 100)
+        full = self.get(self.period).json()
+        short = self.get({**self.period, 'fields': 'url,timeCount'}).json()
+
+        self.assertIn('intervals', full[0])
+        self.assertEqual(set(short[0]), {'url', 'timeCount'})
+
+
+class BrowserURLValidatorTestCase(TestCase):
+    def test_allowed_schemes(self):
+        """Принимаются ссылки со схемами браузера"""
+        validator = BrowserURLValidator()
+        for value in (
+            'https://example.com/page?q=1',
+            'HTTPS://EXAMPLE.COM',
+            'chrome://extensions',
+            'Chrome-Extension://abc/popup.html',
+            'about:blank',
+            'javascript:void(0)',
+            'data:image/png;base64,AAAA',
+            'file:///home/user/index.html',
+        ):
+            validator(value)
+
+    def test_rejected_values(self):
+        """Ссылки без разрешенной схемы отклоняются"""
+        validator = BrowserURLValidator()
+        for value in ('example.com', 'gopher://example.com', 'mailto:user@example.com', ' https://example.com', 'ABOUT:blank', '', None):
+            with self.assertRaises(ValidationError):
+                validator(value)
+
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02'}
+
+    def add(self, day, start, end, url='https://a.com', user=None):
+        TimeInterval.objects.create(
+            url=url, start_time=start, end_time=end, date=date(2025, 1, day), user=user or self.user
+        )
+
+    def get(self, params):
+        return self.client.get('/api/timeline/', params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_merged_timeline(self):
+        """Пересекающиеся интервалы объединяются, время по часам не удваивается"""
+        self.add(1, 0, 1000)
+        self.add(1, 500, 1500, url='https://b.com')
+        self.add(1, 3500, 3700)
+        self.add(2, 7000, 7100)
+        self.add(1, 0, 50000, user=CustomUser.objects.create_user(email='other@test.test', password='testpass'))
+
+        response = self.get(self.period).json()
+
+        self.assertEqual(response['activeTime'], 1800)
+        self.assertEqual(response['timeline'], [
+            {'date': '2025-01-01', 'startTime': 0, 'endTime': 1500},
+            {'date': '2025-01-01', 'startTime': 3500, 'endTime': 3700},
+            {'date': '2025-01-02', 'startTime': 7000, 'endTime': 7100},
+        ])
+        self.assertEqual(response['hours'][:3], [1600, 200, 0])
+        self.assertEqual(sum(response['hours']), 1800)
+        self.assertEqual([day['date'] for day in response['days']], ['2025-01-01', '2025-01-02'])
+
+    def test_focus_sessions(self):
+        """Сессия фокуса - непрерывная работа на одном сайте с короткими паузами"""
+        self.add(1, 0, 1000)
+        self.add(1, 1100, 2000)
+        self.add(1, 2000, 2100, url='https://b.com')
+        self.add(1, 5000, 5100)
+
+        response = self.get({**self.period, 'gap': 300, 'min_duration': 1500}).json()
+
+        self.assertEqual(response['sessions'], [
+            {'url': 'a.com', 'date': '2025-01-01', 'startTime': 0, 'endTime': 2000, 'activeTime': 1900},
+        ])
+
+    def test_overlapping_sites(self):
+        """Длинный интервал другого сайта не склеивает сессии сайта"""
+        self.add(1, 0, 3000)
+        self.add(1, 100, 200, url='https://b.com')
+        self.add(1, 2900, 3100, url='https://b.com')
+
+        response = self.get({**self.period, 'gap': 300, 'min_duration': 0}).json()
+
+        self.assertEqual(response['sessions'], [
+            {'url': 'a.com', 'date': '2025-01-01', 'startTime': 0, 'endTime': 3000, 'activeTime': 3000},
+            {'url': 'b.com', 'date': '2025-01-01', 'startTime': 100, 'endTime': 200, 'activeTime': 100},
+            {'url': 'b.com', 'date': '2025-01-01', 'startTime': 2900, 'endTime': 3100, 'activeTime': 200},
+        ])
+
+    def test_hourly_matches_reference(self):
+        """Почасовое время совпадает с посекундным подсчетом"""
+        rng = random.Random(1)
+        covered = bytearray(2 * 86400)
+        for _ in range(200):
+            day = rng.randint(1, 2)
+            start = rng.randrange(0, 86000)
+            end = start + rng.randint(1, 400)
+            self.add(day, start, end, url=f'https://site{rng.randrange(5)}.com')
+            offset = (day - 1) * 86400
+            covered[offset + start:offset + end] = b'\x01' * (end - start)
+
+        response = self.get(self.period).json()
+
+        expected = [
+            sum(covered[day * 86400 + hour * 3600:day * 86400 + (hour + 1) * 3600])
+            for day in range(2)
+            for hour in range(24)
+        ]
+        self.assertEqual(response['activeTime'], sum(covered))
+        self.assertEqual([hours for day in response['days'] for hours in day['hours']], expected)
+
+    def test_empty_period(self):
+        """Период без интервалов"""
+        response = self.get(self.period).json()
+        self.assertEqual(response['activeTime'], 0)
+        self.assertEqual(response['hours'], [0] * 24)
+        self.assertEqual(response['timeline'], [])
+        self.assertEqual(response['sessions'], [])
+
+    def test_invalid_params(self):
+        """Некорректные параметры запроса"""
+        self.assertEqual(self.get({**self.period, 'gap': 'x'}).status_code, 400)
+        self.assertEqual(self.get({}).status_code, 400)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.factory = AsyncRequestFactory()
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.intervals = [
+            {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com/x', 'faviconUrl': 'https://a.com/favicon.ico'},
+            {'startTime': 300, 'endTime': 400, 'date': '2025-01-02', 'url': 'https://b.com/y'},
+        ]
+
+    async def post(self, data, content_type='application/json', headers=None):
+        request = self.factory.post(
+            '/api/create_intervals/', data, content_type=content_type, headers=self.headers if headers is None else headers
+        )
+        return await create_intervals_async(request)
+
+    async def get_statistics(self, params, headers=None):
+        request = self.factory.get('/api/statistics/', params, headers=self.headers if headers is None else headers)
+        return await StatisticsRangeAsyncView.as_view()(request)
+
+    async def test_create_and_read(self):
+        """Асинхронные представления отвечают так же, как синхронные"""
+        response = await self.post(json.dumps({'intervals': self.intervals}))
+        self.assertEqual(json.loads(response.content), {'status': 'success', 'processed': 2, 'duplicates': 0})
+        response = await self.post(json.dumps({'intervals': self.intervals}))
+        self.assertEqual(json.loads(response.content)['duplicates'], 2)
+        self.assertEqual(await TimeInterval.objects.acount(), 2)
+
+        for params in (
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02'},
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02', 'fields': 'url,timeCount'},
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02', 'granularity': 'auto'},
+            {'period_date_start': '2025-02-01', 'period_date_end': '2025-02-02'},
+            {'period_date_start': '2025-01-02', 'period_date_end': '2025-01-01'},
+        ):
+            response = await self.get_statistics(params)
+            expected = await sync_to_async(self.client.get)(
+                '/api/statistics/', params, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+            )
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_compact_format(self):
+        """Колоночный формат разбирается и в асинхронном представлении"""
+        data = {
+            'urls': ['https://a.com'], 'dates': ['2025-01-01'],
+            'url': [0, 0], 'date': [0, 0], 'start': [100, 200], 'duration': [50, 50],
+        }
+        response = await self.post(json.dumps(data), content_type=CompactIntervalsParser.media_type)
+        self.assertEqual(json.loads(response.content)['processed'], 2)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100)
+    async def test_large_body(self):
+        """Тело больше DATA_UPLOAD_MAX_MEMORY_SIZE принимается, как в синхронном представлении"""
+        response = await self.post(json.dumps({'intervals': self.intervals}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['processed'], 2)
+
+    async def test_errors(self):
+        """Ошибки авторизации и разбора тела"""
+        response = await self.post('{}', headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.get_statistics({}, headers={})
+        self.assertEqual(response.status_code, 401)
+        response = await self.post('{broken')
+        self.assertEqual(response.status_code, 400)
+        response = await self.get_statistics({'period_date_start': '2025-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ReplicaFallbackTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    @override_settings(REPLICA_DATABASE='missing')
+    def test_without_replica(self):
+        """Без настроенной реплики чтения и записи идут в основную базу"""
+        response = self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': [
+                {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://example.com'},
+            ]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(database_for(self.user))
+        self.assertIsNone(ReplicaRouter().db_for_read(Statistics))
+
+        response = self.client.get(
+            '/api/statistics/',
+            {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-01'},
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual([row['url'] for row in response.json()], ['example.com'])
+
+
+def queried_tables(context):
+    """Таблицы из FROM запросов, перехваченных CaptureQueriesContext"""
+    return {
+        match for query in context.captured_queries
+        for match in re.findall(r'FROM "(\w+)"', query['sql'])
+    }
+
+
+@override_settings(REPLICA_READS=True)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    Реплика в тестах - зеркало основной тестовой базы, поэтому данные в
+    ней те же, а откуда пришло чтение, видно по запросам соединений.
+    TransactionTestCase нужен потому, что внутри транзакции основной базы
+    роутер читает ее же
+    """
+    databases = {'default', settings.REPLICA_DATABASE}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-01'}
+        Statistics.objects.create(
+            user=self.user, url='example.com', period_date=date(2025, 1, 1), session_count=1, time_count=10
+        )
+        TimeInterval.objects.create(
+            user=self.user, url='https://example.com', start_time=100, end_time=110, date=date(2025, 1, 1)
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, url, params):
+        return self.client.get(url, params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def post_interval(self):
+        return self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': [
+                {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://primary.com'},
+            ]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def read(self, url, params):
+        """Ответ и таблицы, которые запрос читал на основной базе и на реплике"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[settings.REPLICA_DATABASE]) as replica:
+            response = self.get(url, params)
+        return response, queried_tables(primary), queried_tables(replica)
+
+    def test_reads_from_replica(self):
+        """Статистика и интервалы читаются с реплики, токен - из основной базы"""
+        response, primary, replica = self.read('/api/statistics/', self.period)
+        self.assertEqual([row['url'] for row in response.json()], ['example.com'])
+        self.assertIn('authtoken_token', primary)
+        self.assertNotIn('times_statistics', primary)
+        self.assertIn('times_statistics', replica)
+        self.assertNotIn('authtoken_token', replica)
+
+        response, primary, replica = self.read('/api/intervals/', {'date': '2025-01-01'})
+        self.assertEqual([row['url'] for row in response.json()['results']], ['https://example.com'])
+        self.assertNotIn('times_timeinterval', primary)
+        self.assertIn('times_timeinterval', replica)
+
+    def test_read_your_writes(self):
+        """После записи пользователь читает основную базу, пока действует отметка"""
+        self.assertEqual(self.post_interval().status_code, 200)
+        response, primary, replica = self.read('/api/statistics/', self.period)
+        self.assertEqual(
+            sorted(row['url'] for row in response.json()), ['example.com', 'primary.com']
+        )
+        self.assertIn('times_statistics', primary)
+        self.assertEqual(replica, set())
+
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            cache.clear()
+            response, primary, replica = self.read('/api/statistics/', self.period)
+        self.assertNotIn('times_statistics', primary)
+        self.assertIn('times_statistics', replica)
+
+    def test_primary_transaction(self):
+        """Внутри транзакции основной базы чтения не уходят на реплику"""
+        with reading(settings.REPLICA_DATABASE):
+            self.assertEqual(router.db_for_read(Statistics), settings.REPLICA_DATABASE)
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Statistics), 'default')
+
+    def test_other_users_not_pinned(self):
+        """Отметка после записи касается только записавшего пользователя"""
+        other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+        self.post_interval()
+        self.assertIsNone(database_for(self.user))
+        self.assertEqual(database_for(other), settings.REPLICA_DATABASE)
+
+    def test_async_view(self):
+        """Асинхронное представление статистики тоже читает с реплики"""
+        request = AsyncRequestFactory().get(
+            '/api/statistics/', self.period, headers={'Authorization': f'Token {self.token.key}'}
+        )
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[settings.REPLICA_DATABASE]) as replica:
+            response = async_to_sync(StatisticsRangeAsyncView.as_view())(request)
+        self.assertEqual([row['url'] for row in json.loads(response.content)], ['example.com'])
+        self.assertNotIn('times_statistics', queried_tables(primary))
+        self.assertIn('times_statistics', queried_tables(replica))
+
+
+@override_settings(PERF_SAMPLE_RATE=1)
+class PerformanceMetricsTestCase(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.admin = CustomUser.objects.create_user(
+            email='admin@test.test',
+            password='testpass',
+            is_staff=True
+        )
+        self.admin_token = Token.objects.create(user=self.admin)
+        self.period = {'period_date_start': '2025-01-01', 'period_date_end': '2025-01-02'}
+
+    def tearDown(self):
+        registry.clear()
+
+    def send_intervals(self):
+        return self.client.post(
+            '/api/create_intervals/',
+            data=json.dumps({'intervals': [
+                {'startTime': 100, 'endTime': 200, 'date': '2025-01-01', 'url': 'https://a.com'},
+                {'startTime': 300, 'endTime': 400, 'date': '2025-01-02', 'url': 'https://b.com'},
+            ]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def get_metrics(self, token):
+        return self.client.get('/api/metrics/', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_server_timing(self):
+        """Замеренный запрос отдает время и число запросов к базе"""
+        response = self.send_intervals()
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries, \d+ duplicates"$')
+
+        with override_settings(PERF_SAMPLE_RATE=0):
+            response = self.send_intervals()
+        self.assertNotIn('Server-Timing', response)
+
+    def test_prometheus_endpoint(self):
+        """Суммы по представлениям и кэш токенов в формате Prometheus"""
+        self.send_intervals()
+        response = self.client.get('/api/statistics/', self.period, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.client.get('/api/statistics/', self.period, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        text = self.get_metrics(self.admin_token).content.decode()
+        self.assertIn('times_requests_total{view="create-intervals"} 1', text)
+        self.assertIn('times_requests_total{view="statistics-range"} 2', text)
+        self.assertIn(f'times_rows_serialized_total{{view="statistics-range"}} {2 * len(response.json())}', text)
+        self.assertIn(f'times_response_bytes_total{{view="statistics-range"}} {2 * len(response.content)}', text)
+        self.assertIn('times_request_seconds_bucket{view="statistics-range",le="+Inf"} 2', text)
+        self.assertIn('times_token_cache_hits', text)
+        # Два запроса к базе на чтение, как в StatisticsRangeTestCase
+        self.assertIn('times_queries_total{view="statistics-range"} 4', text)
+
+        self.assertEqual(self.get_metrics(self.token).status_code, 403)
+
+    def test_duplicate_queries(self):
+        """Повтором считается тот же SQL с теми же параметрами"""
+        metrics = RequestMetrics()
+        metrics.add_query('SELECT 1 WHERE id = %s', (1,), 0.001)
+        metrics.add_query('SELECT 1 WHERE id = %s', (2,), 0.001)
+        metrics.add_query('SELECT 1 WHERE id = %s', (1,), 0.001)
+        self.assertEqual((metrics.queries, metrics.duplicates), (3, 1))
+
+    def test_profile_dump(self):
+        """Профиль сохраняется только для запросов дольше порога"""
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PERF_PROFILE_DIR=directory, PERF_PROFILE_THRESHOLD_MS=60000):
+                self.send_intervals()
+            self.assertEqual(os.listdir(directory), [])
+
+            with override_settings(PERF_PROFILE_DIR=directory, PERF_PROFILE_THRESHOLD_MS=0):
+                self.send_intervals()
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            self.assertRegex(files[0], r'^create-intervals-\d+-\d+ms\.prof$')
+
+
+class BenchmarkCommandsTestCase(TestCase):
+
+    def test_generate_and_compare(self):
+        """Синтетические данные повторяемы, регрессия против baseline - ошибка"""
+        options = {'users': 2, 'hosts': 5, 'months': 1, 'intervals_per_day': 4, 'stdout': StringIO()}
+        call_command('generate_synthetic_data', **options)
+        count = TimeInterval.objects.count()
+        self.assertGreater(count, 0)
+        self.assertEqual(Token.objects.count(), 2)
+        self.assertLessEqual(Statistics.objects.values('url').distinct().count(), 5)
+
+        call_command('generate_synthetic_data', **options)
+        self.assertEqual(TimeInterval.objects.count(), count)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'result.json')
+            benchmark = {
+                'repeat': 2, 'batch_sizes': '3', 'ranges': '1,7', 'depths': '1',
+                'output': output, 'stdout': StringIO(),
+            }
+            call_command('run_benchmarks', **benchmark)
+            # Загруженные при замере пакеты откатываются
+            self.assertEqual(TimeInterval.objects.count(), count)
+
+            with open(output) as file:
+                result = json.load(file)
+            self.assertEqual(result['metrics']['create_intervals.batch_3.intervals_per_second']['better'], 'higher')
+            self.assertIn('statistics_range.days_7.p95_ms', result['metrics'])
+            self.assertIn('intervals_list.page_1.cursor_p50_ms', result['metrics'])
+
+            baseline = os.path.join(directory, 'baseline.json')
+            for metric in result['metrics'].values():
+                metric['value'] = metric['value'] * 100 if metric['better'] == 'higher' else metric['value'] / 100
+            with open(baseline, 'w') as file:
+                json.dump(result, file)
+
+            with self.assertRaisesMessage(CommandError, 'Регрессия'):
+                call_command('run_benchmarks', baseline=baseline, **benchmark)
@@ -1,12 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from .views import create_intervals, TimeIntervalViewSet, StatisticsRangeView
+from .views import create_intervals, import_intervals, TimeIntervalViewSet, StatisticsRangeView, StatisticsSummaryView, SyncView, TimelineView, MetricsView
+from .async_views import create_intervals_async, StatisticsRangeAsyncView
 
 time_interval_list = TimeIntervalViewSet.as_view({
     'get': 'list',
 })
 
+if settings.ASYNC_VIEWS:
+    create_intervals_view = create_intervals_async
+    statistics_range_view = StatisticsRangeAsyncView.as_view()
+else:
+    create_intervals_view = create_intervals
+    statistics_range_view = StatisticsRangeView.as_view()
+
 urlpatterns = [
-    path('create_intervals/', create_intervals, name='create-intervals'),
+    path('create_intervals/', create_intervals_view, name='create-intervals'),
+    path('import_intervals/', import_intervals, name='import-intervals'),
     path('intervals/', time_interval_list, name='interval-list'),
-    path('statistics/', StatisticsRangeView.as_view(), name='statistics-range'),
+    path('statistics/', statistics_range_view, name='statistics-range'),
+    path('statistics/summary/', StatisticsSummaryView.as_view(), name='statistics-summary'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('timeline/', TimelineView.as_view(), name='timeline'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,38 +1,41 @@
 import re
+from functools import lru_cache
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
-from django.utils.regex_helper import _lazy_re_compile
+
+BROWSER_URL_SCHEMES = [
+    'http', 'https', 'ftp', 'ftps',
+
+    'chrome', 'chrome-extension',
+    'edge', 'ms-browser-extension',
+    'about', 'moz-extension',
+    'opera', 'otpauth',
+    'safari', 'webkit-extension',
+
+    'data', 'file', 'javascript'
+]
+
+_schemes_re = '|'.join(re.escape(scheme) for scheme in sorted(BROWSER_URL_SCHEMES, key=len, reverse=True))
+# scheme:// в любом регистре или scheme: в нижнем - так же, как принимал
+# прежний валидатор: полная проверка URLValidator пропускала только
+# значения, которые и так начинаются с разрешенной схемы и ://
+BROWSER_URL_RE = re.compile(rf'(?i:{_schemes_re})://|(?:{_schemes_re}):')
+
+
+@lru_cache(maxsize=4096)
+def is_browser_url(value):
+    return BROWSER_URL_RE.match(value) is not None
+
 
 class BrowserURLValidator(URLValidator):
-    schemes = [
-        'http', 'https', 'ftp', 'ftps',
-        
-        'chrome', 'chrome-extension',
-        'edge', 'ms-browser-extension',
-        'about', 'moz-extension',
-        'opera', 'otpauth',
-        'safari', 'webkit-extension',
-        
-        'data', 'file', 'javascript'
-    ]
-
-    ul = URLValidator.ul
-    hostname_re = r'([a-z0-9\-._~%]+|\[[a-f0-9]*:[a-f0-9\.:]+\])'
-    port_re = r'(:\d+)?'
-    path_re = r'([/?#][^\s]*)?'
-    regex = _lazy_re_compile(
-        r'^(?:[a-z0-9\.\-]*)://'  
-        r'(?:\S+(?::\S*)?@)?' 
-        r'(?:' + hostname_re + port_re + ')?'  
-        r'(?:' + path_re + ')?', 
-        re.IGNORECASE)
+    """
+    Проверяет, что ссылка начинается с одной из схем браузера.
+    Одно сопоставление заранее скомпилированного выражения вместо полной
+    проверки URLValidator; пакеты интервалов содержат одни и те же ссылки,
+    поэтому результаты последних проверок запоминаются.
+    """
+    schemes = BROWSER_URL_SCHEMES
 
     def __call__(self, value):
-        try:
-            super().__call__(value)
-        except ValidationError as e:
-            if any(value.lower().startswith(f'{scheme}://') 
-                    or value.startswith(f'{scheme}:') 
-                    for scheme in self.schemes):
-                return
-            raise e
\ No newline at end of file
+        if not isinstance(value, str) or not is_browser_url(value):
+            raise ValidationError(self.message, code=self.code, params={'value': value})
@@ -1,180 +1,405 @@
-from rest_framework import viewsets, pagination, views, status, permissions
+from rest_framework import viewsets, views, status, permissions
 from rest_framework.response import Response
-from rest_framework.decorators import permission_classes, api_view
-from django.http import JsonResponse
+from rest_framework.decorators import permission_classes, api_view, parser_classes
+from rest_framework.exceptions import ParseError
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
-from django.db.models import F, Q
+from django.db.models import F, Max, Sum, Value
+from django.db.models.functions import TruncWeek, TruncMonth
 from django.core.exceptions import ValidationError
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
-from urllib.parse import urlparse
 from datetime import datetime
 import json
-from .models import TimeInterval, Statistics
-from .serializers import TimeIntervalSerializer, StatisticsSerializer
+from .models import TimeInterval, Statistics, prefetch_intervals
+from .serializers import (
+    TimeIntervalSerializer,
+    StatisticsSerializer,
+    StatisticsSummarySerializer,
+    StatisticsRollupSerializer,
+)
+from .rollups import tiered_querysets, period_start
+from .deltas import pending_deltas, apply_to_statistics, apply_to_rows, statistics_snapshot
+from .parsers import JSONParser, CompactIntervalsParser, DecompressedBodyTooLarge
+from .pagination import IntervalPagination, IntervalKeysetPagination
+from .ingest import ingest_intervals, enqueue_intervals
+from .sync import collect_changes
+from . import response_cache
+from .replicas import ReplicaReadMixin
+from .perf import registry
+from users.authentication import token_cache
+from .analytics import build_timeline, FOCUS_MAX_GAP, FOCUS_MIN_DURATION
 
-class TimeIntervalViewSet(viewsets.ModelViewSet):
+class TimeIntervalViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated] 
     queryset = TimeInterval.objects.all().order_by('-date', 'start_time')
     serializer_class = TimeIntervalSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['date', 'start_time', 'end_time']
+    filterset_fields = {
+        'date': ['exact', 'gte', 'lte'],
+        'start_time': ['exact'],
+        'end_time': ['exact'],
+    }
     
-    pagination_class = pagination.PageNumberPagination
-    pagination_class.page_size = 20
+    pagination_class = IntervalPagination
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    @property
+    def paginator(self):
+        """
+        Режим курсора включается параметром pagination=cursor
+        (или переданным курсором) и не считает общее количество строк.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or params.get('cursor'):
+                self._paginator = IntervalKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
         
 
-class StatisticsRangeView(views.APIView):
+def get_period(request):
+    period_date_start = request.query_params.get('period_date_start')
+    period_date_end = request.query_params.get('period_date_end')
+
+    if not period_date_start or not period_date_end:
+        return None, None, "Оба параметра period_date_start и period_date_end обязательны"
+
+    try:
+        start_date = datetime.strptime(period_date_start, "%Y-%m-%d").date()
+        end_date = datetime.strptime(period_date_end, "%Y-%m-%d").date()
+    except ValueError:
+        return None, None, "Неверный формат даты. Используйте YYYY-MM-DD"
+
+    if start_date > end_date:
+        return None, None, "Дата начала периода должна быть раньше или равна дате окончания"
+
+    return start_date, end_date, None
+
+
+class StatisticsRangeView(ReplicaReadMixin, views.APIView):
     permission_classes = [permissions.IsAuthenticated] 
     
     def get(self, request):
-        period_date_start = request.query_params.get('period_date_start')
-        period_date_end = request.query_params.get('period_date_end')
+        start_date, end_date, fields, granularity, error = self.get_params(request)
+        if error:
+            return error
 
-        if not period_date_start or not period_date_end:
-            return Response(
-                {"error": "Оба параметра period_date_start и period_date_end обязательны"},
+        if not response_cache.is_cacheable(start_date, end_date):
+            return self.build_response(request, start_date, end_date, fields, granularity)
+
+        # Повторное чтение того же периода - одно обращение к кэшу;
+        # версии дат меняются при загрузке интервалов
+        options = self.get_cache_options(fields, granularity)
+        data, etag = response_cache.lookup(request.user.pk, start_date, end_date, options)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        if data is None:
+            response = self.build_response(request, start_date, end_date, fields, granularity)
+            response_cache.store(request.user.pk, start_date, end_date, options, etag, response.data)
+        else:
+            response = Response(data, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
+
+    def get_params(self, request):
+        """Период, поля и уровень детализации; при ошибке - ответ с ней"""
+        start_date, end_date, error = get_period(request)
+        if error:
+            return None, None, None, None, Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = self.get_fields(request)
+        if fields is None:
+            return None, None, None, None, Response(
+                {"error": f"Допустимые поля: {', '.join(StatisticsSerializer.Meta.fields)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            start_date = datetime.strptime(period_date_start, "%Y-%m-%d").date()
-            end_date = datetime.strptime(period_date_end, "%Y-%m-%d").date()
-        except ValueError:
-            return Response(
-                {"error": "Неверный формат даты. Используйте YYYY-MM-DD"},
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in ('day', 'auto'):
+            return None, None, None, None, Response(
+                {"error": "Параметр granularity должен быть одним из: day, auto"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        if start_date > end_date:
-            return Response(
-                {"error": "Дата начала периода должна быть раньше или равна дате окончания"},
+        # Строки уровней week и month имеют свой набор полей без интервалов
+        if granularity == 'auto' and ('fields' in request.query_params or 'include' in request.query_params):
+            return None, None, None, None, Response(
+                {"error": "Параметры fields и include недоступны при granularity=auto"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        statistics = Statistics.objects.filter(
+        return start_date, end_date, fields, granularity, None
+
+    def get_cache_options(self, fields, granularity):
+        return f"{granularity}:{','.join(sorted(fields))}"
+
+    def build_response(self, request, start_date, end_date, fields, granularity):
+        with statistics_snapshot():
+            if granularity == 'auto':
+                return self.get_tiered(request, start_date, end_date)
+
+            statistics = list(self.get_statistics(request, start_date, end_date, fields))
+            return self.statistics_response(request, statistics, start_date, end_date, fields)
+
+    def get_statistics(self, request, start_date, end_date, fields):
+        model_fields = StatisticsSerializer.get_model_fields(fields)
+        if 'intervals' in fields:
+            model_fields += ['url', 'period_date', 'user_id']
+        if settings.STATISTICS_DELTAS:
+            model_fields += ['url', 'favicon_url', 'session_count', 'time_count', 'period_date']
+
+        return Statistics.objects.filter(
             period_date__gte=start_date,
             period_date__lte=end_date,
             user__pk=request.user.pk,
-        ).order_by('-time_count')
+        ).only(*model_fields).order_by('-time_count')
+
+    def statistics_response(self, request, statistics, start_date, end_date, fields):
+        if settings.STATISTICS_DELTAS:
+            pending = pending_deltas(request.user.pk, start_date, end_date)
+            statistics = apply_to_statistics(statistics, pending, request.user.pk)
+
+        if 'intervals' in fields:
+            statistics = prefetch_intervals(statistics)
+
+        if not statistics:
+            return Response(
+                {"message": "Данные за указанный период не найдены"},
+                status=status.HTTP_200_OK
+            )
+
+        serializer = StatisticsSerializer(statistics, many=True, fields=fields)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def get_tiered(self, request, start_date, end_date):
+        """
+        Строки из самых крупных уровней (месяц, неделя, день),
+        целиком покрывающих части периода.
+        """
+        statistics, rollups = tiered_querysets(request.user.pk, start_date, end_date)
+        values = ('url', 'favicon_url', 'session_count', 'time_count', 'period_date', 'period')
+
+        rows = list(statistics.annotate(period=Value('day')).values(*values))
+        rows += list(rollups.values(*values))
+        if settings.STATISTICS_DELTAS:
+            pending = pending_deltas(request.user.pk, start_date, end_date)
+            rows = apply_to_rows(rows, pending, start_date, end_date)
+        rows.sort(key=lambda row: -row['time_count'])
 
-        if not statistics.exists():
+        if not rows:
             return Response(
                 {"message": "Данные за указанный период не найдены"},
                 status=status.HTTP_200_OK
             )
 
-        serializer = StatisticsSerializer(statistics, many=True)
+        serializer = StatisticsRollupSerializer(rows, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def get_fields(self, request):
+        """
+        Поля ответа из параметров fields и include. Без обоих параметров
+        возвращаются все поля вместе с интервалами, как и раньше;
+        интервалы в остальных случаях отдаются только по include=intervals
+        или явному указанию в fields.
+        """
+        fields_param = request.query_params.get('fields')
+        include_param = request.query_params.get('include')
+        all_fields = StatisticsSerializer.Meta.fields
+
+        if fields_param is None and include_param is None:
+            return list(all_fields)
+
+        if fields_param:
+            fields = [name.strip() for name in fields_param.split(',') if name.strip()]
+        else:
+            fields = [name for name in all_fields if name != 'intervals']
+
+        include = {name.strip() for name in (include_param or '').split(',') if name.strip()}
+        if 'intervals' in include and 'intervals' not in fields:
+            fields.append('intervals')
+
+        if set(fields) - set(all_fields) or include - {'intervals'}:
+            return None
+        return fields
+
+class StatisticsSummaryView(views.APIView):
+    """
+    Суммарная статистика за период, посчитанная в базе:
+    по сайтам (group_by=url) или по дням, неделям и месяцам.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    periods = {
+        'day': lambda: F('period_date'),
+        'week': lambda: TruncWeek('period_date'),
+        'month': lambda: TruncMonth('period_date'),
+    }
+
+    def get(self, request):
+        start_date, end_date, error = get_period(request)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        group_by = request.query_params.get('group_by', 'url')
+        if group_by != 'url' and group_by not in self.periods:
+            return Response(
+                {"error": "Параметр group_by должен быть одним из: url, day, week, month"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                return Response(
+                    {"error": "Параметр limit должен быть положительным целым числом"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = int(limit)
+
+        with statistics_snapshot():
+            if group_by == 'url':
+                summary = self.get_url_summary(request, start_date, end_date)
+            else:
+                statistics = Statistics.objects.filter(
+                    period_date__gte=start_date,
+                    period_date__lte=end_date,
+                    user__pk=request.user.pk,
+                )
+                summary = statistics.annotate(
+                    period=self.periods[group_by](),
+                ).values('period').annotate(
+                    session_count=Sum('session_count'),
+                    time_count=Sum('time_count'),
+                ).order_by('period')
+
+                if settings.STATISTICS_DELTAS:
+                    summary = self.apply_pending_periods(list(summary), group_by, request, start_date, end_date)
+
+        if limit is not None:
+            summary = summary[:limit]
+
+        serializer = StatisticsSummarySerializer(summary, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def get_url_summary(self, request, start_date, end_date):
+        summary = {}
+        for queryset in tiered_querysets(request.user.pk, start_date, end_date):
+            rows = queryset.values('url').annotate(
+                favicon_url=Max('favicon_url'),
+                session_count=Sum('session_count'),
+                time_count=Sum('time_count'),
+            ).order_by()
+
+            for row in rows:
+                if row['url'] not in summary:
+                    summary[row['url']] = row
+                    continue
+
+                total = summary[row['url']]
+                total['session_count'] += row['session_count']
+                total['time_count'] += row['time_count']
+                total['favicon_url'] = total['favicon_url'] or row['favicon_url']
+
+        if settings.STATISTICS_DELTAS:
+            for (url, period_date), data in pending_deltas(request.user.pk, start_date, end_date).items():
+                row = summary.setdefault(url, {'url': url, 'favicon_url': None, 'session_count': 0, 'time_count': 0})
+                row['session_count'] += data['session_count']
+                row['time_count'] += data['time_count']
+                row['favicon_url'] = row['favicon_url'] or data['favicon_url']
+
+        return sorted(summary.values(), key=lambda row: (-row['time_count'], row['url']))
+
+    def apply_pending_periods(self, summary, group_by, request, start_date, end_date):
+        by_period = {row['period']: row for row in summary}
+        for (url, period_date), data in pending_deltas(request.user.pk, start_date, end_date).items():
+            period = period_date if group_by == 'day' else period_start(group_by, period_date)
+            row = by_period.setdefault(period, {'period': period, 'session_count': 0, 'time_count': 0})
+            row['session_count'] += data['session_count']
+            row['time_count'] += data['time_count']
+
+        return sorted(by_period.values(), key=lambda row: row['period'])
+
+class TimelineView(views.APIView):
+    """
+    Временная шкала пользователя за период: объединенные без пересечений
+    отрезки активности, активное время по часам и сессии фокуса.
+    Параметры gap и min_duration (в секундах) задают допустимую паузу
+    внутри сессии и ее минимальную длительность.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        start_date, end_date, error = get_period(request)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            max_gap = int(request.query_params.get('gap', FOCUS_MAX_GAP))
+            min_duration = int(request.query_params.get('min_duration', FOCUS_MIN_DURATION))
+        except ValueError:
+            return Response(
+                {"error": "Параметры gap и min_duration должны быть целыми числами"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        timeline = build_timeline(request.user.pk, start_date, end_date, max_gap, min_duration)
+        return Response(timeline, status=status.HTTP_200_OK)
+
+
+class SyncView(views.APIView):
+    """
+    Инкрементальная синхронизация: интервалы и статистика пользователя,
+    измененные после токена since. Без since отдается все с начала.
+    Если more=true, изменения отданы не полностью и следующий запрос
+    нужно сделать сразу с полученным токеном next.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    statistics_fields = ['url', 'faviconUrl', 'sessionCount', 'timeCount', 'periodDate']
+
+    def get(self, request):
+        changes, next_token, more = collect_changes({
+            'intervals': TimeInterval.objects.filter(user__pk=request.user.pk),
+            'statistics': Statistics.objects.filter(user__pk=request.user.pk),
+        }, request.query_params.get('since'))
+
+        return Response({
+            'intervals': TimeIntervalSerializer(changes['intervals'], many=True).data,
+            'statistics': StatisticsSerializer(changes['statistics'], many=True, fields=self.statistics_fields).data,
+            'next': next_token,
+            'more': more,
+        })
+
 @csrf_exempt
 @transaction.atomic
 @api_view(["POST"])
+@parser_classes([JSONParser, CompactIntervalsParser])
 @permission_classes([permissions.IsAuthenticated])
 def create_intervals(request):
     try:
-        data = request.data
-        
-        intervals_data = data.get('intervals', [])
-        intervals = []
-        check_duplicates = []
-        stats_updates = {}
-
-        for item in intervals_data:
-            favicon_url = item.get('faviconUrl')
-            
-            interval = TimeInterval(
-                start_time=item['startTime'],
-                end_time=item['endTime'],
-                date=item['date'],
-                url=item['url'] if len(item['url']) <= 500 else '{url.scheme}://{url.netloc}'.format(url=urlparse(item["url"])),
-                favicon_url=favicon_url if favicon_url is not None and len(favicon_url) <= 500 else None,
-                user=request.user,
-            )
-            
-            interval.full_clean()
-            
-            check_duplicates.append({
-                'url': interval.url,
-                'date': interval.date,
-                'start_time': interval.start_time,
-                'end_time': interval.end_time,
-                'favicon_url': interval.favicon_url,
-                'user': interval.user,
-            })
-            
-            intervals.append(interval)
-            
-        existing_intervals = set()
-        if check_duplicates:
-            q_objects = Q()
-            for item in check_duplicates:
-                q_objects |= Q(
-                    url=item['url'],
-                    date=item['date'],
-                    start_time=item['start_time'],
-                    end_time=item['end_time'],
-                    favicon_url=item['favicon_url'],
-                    user=item['user'],
-                )
-            
-            existing = TimeInterval.objects.filter(q_objects).values_list(
-                'url', 'date', 'start_time', 'end_time', 'user'
-            )
-            existing_intervals = {
-                (item[0], item[1], item[2], item[3], item[4]) for item in existing
-            }
-            
-        new_intervals = []
-        for interval in intervals:
-            key = (
-                interval.url,
-                interval.date,
-                interval.start_time,
-                interval.end_time,
-                interval.user,
-            )
-            if key not in existing_intervals:
-                new_intervals.append(interval)
-                
-                stats_key = (interval.url, interval.date)
-                if stats_key not in stats_updates:
-                    stats_updates[stats_key] = {
-                        'session_count': 0,
-                        'time_count': 0,
-                        'favicon_url': interval.favicon_url
-                    }
-                
-                stats_updates[stats_key]['session_count'] += 1
-                stats_updates[stats_key]['time_count'] += interval.end_time - interval.start_time            
-
-        for (url, date), data in stats_updates.items():
-            stat, created = Statistics.objects.update_or_create(
-                url=urlparse(url).hostname,
-                period_date=date,
-                user=request.user,
-                defaults={
-                    'session_count': data['session_count'],
-                    'time_count': data['time_count'],
-                    'favicon_url': data.get('favicon_url') or Statistics.objects.filter(url=url).values_list('favicon_url', flat=True).first()
-                }
-            )
+        if request.query_params.get('mode') == 'async':
+            batch = enqueue_intervals(request.data.get('intervals', []), request.user)
+            return JsonResponse({
+                    'status': 'accepted',
+                    'batch': batch.pk,
+                    'queued': len(batch.payload),
+                }, status=202)
 
-            if not created:
-                Statistics.objects.filter(pk=stat.pk).update(
-                    session_count=F('session_count') + data['session_count'],
-                    time_count=F('time_count') + data['time_count']
-                )
+        processed, duplicates = ingest_intervals(request.data.get('intervals', []), request.user)
 
-        TimeInterval.objects.bulk_create(new_intervals)
-        
         return JsonResponse({
                 'status': 'success', 
-                'processed': len(intervals),
-                'duplicates': len(intervals) - len(new_intervals),
+                'processed': processed,
+                'duplicates': duplicates,
             })
     
-    except json.JSONDecodeError:
+    except DecompressedBodyTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+    except (json.JSONDecodeError, ParseError):
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except KeyError as e:
         return JsonResponse({'error': f'Missing field: {str(e)}'}, status=400)
@@ -182,3 +407,72 @@ def create_intervals(request):
         return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+
+IMPORT_CHUNK_SIZE = 1000
+
+
+def read_ndjson_chunks(stream, chunk_size):
+    chunk = []
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            chunk.append(json.loads(line))
+        except json.JSONDecodeError:
+            raise ParseError(f'Invalid JSON at line {line_number}')
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+@csrf_exempt
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def import_intervals(request):
+    """
+    Загрузка интервалов в формате NDJSON (один интервал на строку).
+    Тело читается из потока построчно, каждая порция сохраняется
+    в отдельной транзакции, поэтому память не зависит от размера загрузки.
+    """
+    chunks = []
+    try:
+        for items in read_ndjson_chunks(request._request, IMPORT_CHUNK_SIZE):
+            with transaction.atomic():
+                processed, duplicates = ingest_intervals(items, request.user)
+            chunks.append({'processed': processed, 'duplicates': duplicates})
+
+        return JsonResponse({
+            'status': 'success',
+            'processed': sum(chunk['processed'] for chunk in chunks),
+            'duplicates': sum(chunk['duplicates'] for chunk in chunks),
+            'chunks': chunks,
+        })
+
+    except ParseError as e:
+        return JsonResponse({'error': str(e), 'chunks': chunks}, status=400)
+    except KeyError as e:
+        return JsonResponse({'error': f'Missing field: {str(e)}', 'chunks': chunks}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': str(e), 'chunks': chunks}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e), 'chunks': chunks}, status=500)
+
+
+class MetricsView(views.APIView):
+    """
+    Замеры запросов этого процесса в текстовом формате Prometheus и
+    счетчики кэша токенов. Доступно персоналу, например по токену.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        extra = {f'times_token_cache_{name}': value for name, value in token_cache.stats().items()}
+        return HttpResponse(registry.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from rest_framework.authtoken.models import Token
+        from .authentication import invalidate_token, invalidate_user_tokens
+        from .models import CustomUser
+
+        post_save.connect(invalidate_token, sender=Token)
+        post_delete.connect(invalidate_token, sender=Token)
+        post_save.connect(invalidate_user_tokens, sender=CustomUser)
+        post_delete.connect(invalidate_user_tokens, sender=CustomUser)
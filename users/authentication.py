@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+
+class TokenCache:
+    """
+    Кэш соответствия токена пользователю. Первый уровень - LRU в памяти
+    процесса с ограниченным временем жизни записей, второй - необязательный
+    общий кэш Django (TOKEN_CACHE_ALIAS). При отзыве в общий кэш на
+    TOKEN_CACHE_TTL кладется отметка, и записи других процессов о токене
+    не используются, пока она есть. Без общего кэша отозванный токен
+    принимается другими процессами не дольше TOKEN_CACHE_TTL.
+    """
+    key_prefix = 'auth_token:'
+    revoked_prefix = 'auth_token_revoked:'
+
+    def __init__(self, max_size, ttl, alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.alias = alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def get(self, key):
+        found = self.shared.get_many(self.shared_keys(key)) if self.shared is not None else {}
+        return self.resolve(key, found)
+
+    async def aget(self, key):
+        found = await self.shared.aget_many(self.shared_keys(key)) if self.shared is not None else {}
+        return self.resolve(key, found)
+
+    def shared_keys(self, key):
+        return [self.key_prefix + key, self.revoked_prefix + key]
+
+    def resolve(self, key, found):
+        """Запись из памяти или общего кэша, если токен недавно не отзывали"""
+        if found.get(self.revoked_prefix + key):
+            self.drop_local(key)
+            value = None
+        else:
+            value = self.get_local(key)
+            if value is None:
+                value = self.found_shared(key, found.get(self.key_prefix + key))
+        if value is None:
+            self.count_miss()
+        return value
+
+    def get_local(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+        return None
+
+    def found_shared(self, key, value):
+        if value is not None:
+            self.put_local(key, value)
+            with self.lock:
+                self.shared_hits += 1
+        return value
+
+    def count_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def set(self, key, value):
+        self.put_local(key, value)
+        if self.shared is not None:
+            self.shared.set(self.key_prefix + key, value, self.ttl)
+
+    async def aset(self, key, value):
+        self.put_local(key, value)
+        if self.shared is not None:
+            await self.shared.aset(self.key_prefix + key, value, self.ttl)
+
+    def put_local(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def drop_local(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate(self, key):
+        self.drop_local(key)
+        if self.shared is not None:
+            self.shared.set(self.revoked_prefix + key, True, self.ttl)
+            self.shared.delete(self.key_prefix + key)
+
+    def invalidate_user(self, user_pk):
+        with self.lock:
+            keys = [key for key, (expires, (user, token)) in self.entries.items() if user.pk == user_pk]
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+            }
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, не обращающаяся к базе для недавно проверенных токенов"""
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            self.cache.set(key, cached)
+
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
+
+    async def aauthenticate(self, request):
+        """
+        Асинхронный вариант authenticate для async-представлений Django:
+        токен из кэша проверяется без перехода в поток, запрос к базе
+        выполняется через асинхронный ORM.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+
+        cached = await self.cache.aget(key)
+        if cached is None:
+            try:
+                token = await Token.objects.select_related('user').aget(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cached = (token.user, token)
+            await self.cache.aset(key, cached)
+
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
+
+
+def invalidate_token(sender, instance, created=False, **kwargs):
+    # Новый ключ еще не может быть в кэше
+    if not created:
+        token_cache.invalidate(instance.key)
+
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        token_cache.invalidate(key)
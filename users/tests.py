@@ -1,3 +1,116 @@
+from django.core.cache import caches
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from .authentication import TokenCache, token_cache
+from .models import CustomUser
 
-# Create your tests here.
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='testuser@test.test',
+            password='testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def tearDown(self):
+        token_cache.alias = None
+        token_cache.clear()
+
+    def get(self, key=None):
+        return self.client.get(
+            '/api/intervals/',
+            HTTP_AUTHORIZATION=f'Token {key or self.token.key}'
+        )
+
+    def count_queries(self, key=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(key)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def auth_queries(self, queries):
+        return [sql for sql in queries if Token._meta.db_table in sql]
+
+    def test_cached_authentication(self):
+        """Повторный запрос с тем же токеном не читает токен из базы"""
+        response, queries = self.count_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.auth_queries(queries)), 1)
+
+        response, queries = self.count_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.auth_queries(queries), [])
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_revoked_token(self):
+        """Удаленный токен сразу перестает приниматься"""
+        self.assertEqual(self.get().status_code, 200)
+        key = self.token.key
+        self.token.delete()
+        self.assertEqual(self.get(key).status_code, 401)
+
+    def test_inactive_user(self):
+        """Деактивация пользователя сбрасывает кэш его токенов"""
+        self.assertEqual(self.get().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_login_recreates_token(self):
+        """Вход после отзыва токена выдает новый, старый не принимается"""
+        self.assertEqual(self.get().status_code, 200)
+        old_key = self.token.key
+        Token.objects.filter(pk=old_key).delete()
+
+        response = self.client.post(
+            '/api/login/',
+            {'username': 'testuser@test.test', 'password': 'testpass'},
+            content_type='application/json'
+        )
+        new_key = response.json()['token']
+        self.assertNotEqual(new_key, old_key)
+        self.assertEqual(self.get(old_key).status_code, 401)
+        self.assertEqual(self.get(new_key).status_code, 200)
+
+    def test_shared_cache(self):
+        """Общий кэш отдает токен, вытесненный из памяти процесса"""
+        token_cache.alias = 'default'
+        caches['default'].clear()
+        self.get()
+        token_cache.entries.clear()
+
+        response, queries = self.count_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.auth_queries(queries), [])
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+
+    def test_shared_revocation(self):
+        """Отзыв токена в одном процессе сразу видят процессы с общим кэшем"""
+        token_cache.alias = 'default'
+        caches['default'].clear()
+        other_process = TokenCache(max_size=10, ttl=60, alias='default')
+        key = self.token.key
+        cached = (self.user, self.token)
+        other_process.set(key, cached)
+        self.assertEqual(other_process.get(key), cached)
+
+        self.token.delete()
+        self.assertIsNone(other_process.get(key))
+        self.assertEqual(other_process.stats()['size'], 0)
+
+    def test_lru_eviction(self):
+        """Размер кэша в памяти ограничен"""
+        max_size = token_cache.max_size
+        token_cache.max_size = 1
+        try:
+            other = CustomUser.objects.create_user(email='other@test.test', password='testpass')
+            other_token = Token.objects.create(user=other)
+            self.get()
+            self.get(other_token.key)
+            self.assertEqual(list(token_cache.entries), [other_token.key])
+        finally:
+            token_cache.max_size = max_size
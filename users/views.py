@@ -9,6 +9,7 @@ from django.contrib.auth import authenticate
 from django.http import JsonResponse
 from .models import CustomUser
 from .serializers import UserSerializer
+from .authentication import token_cache
 from django.middleware.csrf import get_token
 
 def csrf(request):
@@ -35,6 +36,9 @@ def custom_token_login(request):
     
     if user:
         token, created = Token.objects.get_or_create(user=user)
+        if created:
+            # Прежний токен пользователя мог остаться в кэше этого процесса
+            token_cache.invalidate_user(user.pk)
         return Response({'token': token.key})
     
     return Response(
@@ -0,0 +1,11 @@
+from urllib.parse import urlparse
+
+def get_hostname(url):
+    if not url:
+        return None
+
+    parsed_url = urlparse(url)
+    if not parsed_url.hostname:
+        parsed_url = urlparse(f"http://{url}")
+
+    return parsed_url.hostname